@@ -11,31 +11,41 @@ __version__ = '1.5.0'
 import os
 import re
 import sys
-import select
+import csv
+import json
+import hashlib
+import time
 import codecs
+from time import perf_counter
+import threading
+import selectors
 import textwrap
 import warnings
-from buildozer.jsonstore import JsonStore
+from buildozer.jsonstore import JsonStore, SqliteStore
+from buildozer.filecopy import FileCopier, copy_file
+from buildozer.download import DownloadManager
+from buildozer.archive import extract_archive, is_archive
+from buildozer.watch import create_watcher, watch as watch_changes
+from buildozer.buildtrace import BuildTrace, summarize
+from buildozer.target import discover_targets
 from sys import stdout, stderr, exit
 from re import search
-from os.path import join, exists, dirname, realpath, splitext, expanduser
+from os.path import (join, exists, dirname, realpath, splitext, expanduser,
+                     basename, lexists, islink)
 from subprocess import Popen, PIPE, TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import environ, unlink, walk, sep, listdir, makedirs
 from copy import copy
-from shutil import copyfile, rmtree, copytree, move
-from fnmatch import fnmatch
+from collections import deque
+from shutil import copyfile, copy2, rmtree, move
+from fnmatch import translate
 
 from pprint import pformat
+from email.parser import HeaderParser
 import shlex
 import pexpect
 
-from urllib.request import FancyURLopener
 from configparser import ConfigParser
-try:
-    import fcntl
-except ImportError:
-    # on windows, no fcntl
-    fcntl = None
 try:
     # if installed, it can give color to windows as well
     import colorama
@@ -73,14 +83,14 @@ LOG_LEVELS_C = (RED, BLUE, BLACK)
 LOG_LEVELS_T = 'EID'
 SIMPLE_HTTP_SERVER_PORT = 8000
 
+# marks a config token that is not set
+_MISSING = object()
 
-class ChromeDownloader(FancyURLopener):
-    version = (
-        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
-        '(KHTML, like Gecko) Chrome/28.0.1500.71 Safari/537.36')
+# parsed and migrated spec files of this process, by path and content hash
+_parsed_specs = {}
 
-
-urlretrieve = ChromeDownloader().retrieve
+# configurations already validated by this process
+_validated_configs = set()
 
 
 class BuildozerException(Exception):
@@ -99,6 +109,253 @@ class BuildozerCommandException(BuildozerException):
     pass
 
 
+class OutputPump:
+    '''
+    Pump the output pipes of a process until they are all closed.
+
+    Pipes are read in large chunks as soon as they are ready, decoded
+    incrementally, and written to their sink a whole line at a time, so the
+    output of stdout and stderr does not get mixed mid-line. Sinks are
+    flushed at most every `flush_interval` seconds, not after each read.
+    The last `tail_size` bytes of output can be kept for error reports.
+    '''
+
+    read_size = 64 * 1024
+    flush_interval = 0.1
+
+    def __init__(self, tail_size=0):
+        self.pipes = {}
+        self.tail = deque()
+        self.tail_len = 0
+        self.tail_size = tail_size
+        # something was written to a sink since the last flush
+        self.unflushed = False
+
+    def add(self, pipe, sink=None, capture=False):
+        self.pipes[pipe] = {
+            'sink': sink,
+            'chunks': [] if capture else None,
+            'decoder': codecs.getincrementaldecoder('utf-8')('replace'),
+            'pending': '',
+        }
+
+    def captured(self, pipe):
+        if pipe not in self.pipes or self.pipes[pipe]['chunks'] is None:
+            return None
+        return b''.join(self.pipes[pipe]['chunks'])
+
+    def get_tail(self):
+        return b''.join(self.tail).decode('utf-8', 'replace')
+
+    def run(self, run_condition=None):
+        '''Pump until every pipe is closed, or `run_condition()` is false.
+        '''
+        last_flush = time.monotonic()
+        with selectors.DefaultSelector() as selector:
+            for pipe in self.pipes:
+                selector.register(pipe, selectors.EVENT_READ)
+            while selector.get_map() and (not run_condition or run_condition()):
+                timeout = 1 if run_condition else None
+                if self.unflushed:
+                    # wake up in time to flush, even if the command is silent
+                    delay = max(0, last_flush + self.flush_interval - time.monotonic())
+                    timeout = delay if timeout is None else min(timeout, delay)
+                for key, _ in selector.select(timeout):
+                    chunk = os.read(key.fd, self.read_size)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                    self._feed(self.pipes[key.fileobj], chunk)
+                now = time.monotonic()
+                if self.unflushed and now - last_flush >= self.flush_interval:
+                    self.flush()
+                if not self.unflushed:
+                    last_flush = now
+        for stream in self.pipes.values():
+            if stream['pending'] and stream['sink']:
+                stream['sink'].write(stream['pending'])
+                stream['pending'] = ''
+        self.flush()
+
+    def flush(self):
+        for stream in self.pipes.values():
+            if stream['sink']:
+                stream['sink'].flush()
+        self.unflushed = False
+
+    def _feed(self, stream, chunk):
+        if stream['chunks'] is not None and chunk:
+            stream['chunks'].append(chunk)
+        if self.tail_size and chunk:
+            self.tail.append(chunk)
+            self.tail_len += len(chunk)
+            while self.tail_len - len(self.tail[0]) >= self.tail_size:
+                self.tail_len -= len(self.tail.popleft())
+        if stream['sink'] is None:
+            return
+        text = stream['pending'] + stream['decoder'].decode(chunk, not chunk)
+        # \r is a line end too, to keep progress bars moving
+        end = max(text.rfind('\n'), text.rfind('\r')) + 1
+        if end:
+            stream['sink'].write(text[:end])
+            self.unflushed = True
+        stream['pending'] = text[end:]
+
+
+class PrefixedOutput:
+    '''
+    Text stream wrapper prefixing every line written with a name, used to
+    tell apart the output of commands running concurrently.
+    '''
+
+    lock = threading.Lock()
+
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.at_line_start = True
+
+    def write(self, text):
+        out = []
+        for line in re.findall(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+', text):
+            if self.at_line_start:
+                out.append(self.prefix)
+            out.append(line)
+            self.at_line_start = line[-1] in '\r\n'
+        with self.lock:
+            self.stream.write(''.join(out))
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+
+class SourceFilter:
+    '''
+    Compiled form of the [app] source.include_exts, source.exclude_exts,
+    source.exclude_dirs, source.include_patterns and source.exclude_patterns
+    rules.
+
+    Paths are matched relative to the source directory, lowercased, and
+    directories end with a "/" (so excluding "image" keeps "images").
+    '''
+
+    def __init__(self, include_exts=None, exclude_exts=None, exclude_dirs=None,
+                 include_patterns=None, exclude_patterns=None):
+        self.include_exts = frozenset(ext.lower() for ext in include_exts or ())
+        self.exclude_exts = frozenset(ext.lower() for ext in exclude_exts or ())
+        self.exclude_dirs = tuple(
+            dn.lower() if dn.endswith('/') else dn.lower() + '/'
+            for dn in exclude_dirs or () if dn)
+        include_patterns = [pat.lower() for pat in include_patterns or () if pat]
+        self.include_re = self._compile(include_patterns)
+        self.exclude_re = self._compile(
+            [pat.lower() for pat in exclude_patterns or () if pat])
+        # literal part of the include patterns, to know whether anything
+        # below an excluded directory could be included again
+        self.include_prefixes = tuple(
+            re.split(r'[*?[]', pat, maxsplit=1)[0] for pat in include_patterns)
+
+    @classmethod
+    def from_config(cls, config):
+        getlist = config.getlist
+        return cls(
+            include_exts=getlist('app', 'source.include_exts', ''),
+            exclude_exts=getlist('app', 'source.exclude_exts', ''),
+            exclude_dirs=getlist('app', 'source.exclude_dirs', ''),
+            include_patterns=getlist('app', 'source.include_patterns', ''),
+            exclude_patterns=getlist('app', 'source.exclude_patterns', ''))
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(translate(pat) for pat in patterns))
+
+    def is_dir_excluded(self, filtered_root):
+        excluded = filtered_root.startswith(self.exclude_dirs)
+        if not excluded and self.exclude_re:
+            excluded = self.exclude_re.match(filtered_root) is not None
+        if excluded and self.include_re:
+            excluded = self.include_re.match(filtered_root) is None
+        return excluded
+
+    def can_skip_tree(self, filtered_root):
+        '''Return True if nothing below this directory can be included.
+        '''
+        if not filtered_root.startswith(self.exclude_dirs):
+            return False
+        for prefix in self.include_prefixes:
+            if prefix.startswith(filtered_root) or filtered_root.startswith(prefix):
+                return False
+        return self.is_dir_excluded(filtered_root)
+
+    def is_file_included(self, filtered_root, fn):
+        # avoid hidden files
+        if fn.startswith('.'):
+            return False
+
+        dfn = join(filtered_root, fn) if filtered_root else fn.lower()
+        if self.exclude_re and self.exclude_re.match(dfn):
+            if not self.include_re or not self.include_re.match(dfn):
+                return False
+
+        ext = splitext(fn)[1]
+        if ext:
+            ext = ext[1:].lower()
+            if self.include_exts and ext not in self.include_exts:
+                return False
+            if ext in self.exclude_exts:
+                return False
+        return True
+
+    def walk(self, source_dir, top=None):
+        '''Like os.walk(), yield (root, files) with only the included files,
+        pruning hidden and excluded subtrees instead of descending into them.
+        `top` restricts the walk to a directory inside `source_dir`; nothing
+        is yielded if `top` itself is in a pruned subtree.
+        '''
+        if top and top != source_dir:
+            filtered_root = ''
+            for dn in top[len(source_dir) + 1:].split(sep):
+                filtered_root += dn.lower() + '/'
+                if dn.startswith('.') or self.can_skip_tree(filtered_root):
+                    return
+        for root, dirs, files in walk(top or source_dir, followlinks=True):
+            filtered_root = root[len(source_dir) + 1:].lower()
+            if filtered_root:
+                filtered_root += '/'
+
+            dirs[:] = [dn for dn in dirs if not dn.startswith('.') and
+                       not self.can_skip_tree(filtered_root + dn.lower() + '/')]
+
+            if filtered_root and self.is_dir_excluded(filtered_root):
+                continue
+            yield root, [fn for fn in files
+                         if self.is_file_included(filtered_root, fn)]
+
+
+class BuildStep:
+    '''
+    A step of :meth:`Buildozer.prepare_for_build` or :meth:`Buildozer.build`.
+
+    `requires` names the steps to run before this one. `inputs` is a
+    callable returning a JSON-serializable description of everything the
+    step result depends on, and `outputs` the paths it must have created;
+    together they let an unchanged step be skipped. Without `inputs` or
+    `outputs`, the step always runs (for steps that set up the environment
+    of the following ones, or that are incremental by themselves).
+    '''
+
+    def __init__(self, name, func, requires=(), inputs=None, outputs=(),
+                 title=None):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.inputs = inputs
+        self.outputs = tuple(outputs)
+        self.title = title or name
+
+
 class Buildozer:
 
     ERROR = 0
@@ -106,7 +363,13 @@ class Buildozer:
     DEBUG = 2
 
     standard_cmds = ('distclean', 'update', 'debug', 'release',
-                     'deploy', 'run', 'serve')
+                     'deploy', 'run', 'serve', 'watch')
+
+    # amount of hidden command output shown when the command fails
+    output_tail_size = 16 * 1024
+
+    # state stores by filename, kept between commands by the daemon
+    state_stores = None
 
     def __init__(self, filename='buildozer.spec', target=None):
         self.log_level = 2
@@ -115,6 +378,10 @@ class Buildozer:
         self.state = None
         self.build_id = None
         self.config_profile = ''
+        self.force_build = False
+        self.trace = BuildTrace()
+        self._file_copier = None
+        self._download_manager = None
         self.config = ConfigParser(allow_no_value=True)
         self.config.optionxform = lambda value: value
         self.config.getlist = self._get_config_list
@@ -122,9 +389,13 @@ class Buildozer:
         self.config.getdefault = self._get_config_default
         self.config.getbooldefault = self._get_config_bool
         self.config.getrawdefault = self._get_config_raw_default
+        # resolved values are memoized until the config is modified
+        self._config_cache = {}
+        self.config.set = self._set_config
+        self.config.remove_option = self._remove_config_option
 
         if exists(filename):
-            self.config.read(filename, "utf-8")
+            self.read_spec(filename)
             self.check_configuration_tokens()
 
         # Check all section/tokens for env vars, and replace the
@@ -165,19 +436,23 @@ class Buildozer:
 
         self.info('Preparing build')
 
-        self.info('Check requirements for {0}'.format(self.targetname))
-        self.target.check_requirements()
-
-        self.info('Install platform')
-        self.target.install_platform()
-
-        self.info('Check application requirements')
-        self.check_application_requirements()
-
-        self.check_garden_requirements()
-
-        self.info('Compile platform')
-        self.target.compile_platform()
+        target = self.target
+        self.run_build_steps(target.get_build_steps([
+            BuildStep('requirements', target.check_requirements,
+                      title='Check requirements for {0}'.format(self.targetname)),
+            BuildStep('platform', target.install_platform,
+                      requires=('requirements', ),
+                      title='Install platform'),
+            BuildStep('app_requirements', self._check_all_requirements,
+                      requires=('platform', ),
+                      title='Check application requirements'),
+            BuildStep('compile_platform', target.compile_platform,
+                      requires=('platform', 'app_requirements'),
+                      inputs=lambda: {'spec': self.spec_fingerprint(),
+                                      'update': target.platform_update},
+                      outputs=target.get_platform_paths(),
+                      title='Compile platform'),
+        ]))
 
         # flag to prevent multiple build
         self.target._build_prepared = True
@@ -196,19 +471,120 @@ class Buildozer:
         if hasattr(self.target, '_build_done'):
             return
 
-        # increment the build number
-        self.build_id = int(self.state.get('cache.build_id', '0')) + 1
-        self.state['cache.build_id'] = str(self.build_id)
-
-        self.info('Build the application #{}'.format(self.build_id))
-        self.build_application()
-
-        self.info('Package the application')
-        self.target.build_package()
+        # increment the build number, kept only if a new package is built
+        last_build_id = int(self.state.get('cache.build_id', '0'))
+        self.build_id = last_build_id + 1
+
+        target = self.target
+        ran = self.run_build_steps(target.get_build_steps([
+            BuildStep('application', self.build_application,
+                      title='Build the application #{}'.format(self.build_id)),
+            BuildStep('package', target.build_package,
+                      requires=('application', ),
+                      inputs=self._package_inputs,
+                      outputs=target.get_artifact_paths(),
+                      title='Package the application'),
+        ]))
+        if 'package' in ran:
+            self.state['cache.build_id'] = str(self.build_id)
+        else:
+            self.build_id = last_build_id
 
         # flag to prevent multiple build
         self.target._build_done = True
 
+    def run_build_steps(self, steps):
+        '''Run the :class:`BuildStep` list in dependency order, skipping the
+        steps that are up to date, and return the names of the steps run.
+
+        A step with `inputs` and `outputs` is up to date when the
+        fingerprint of its inputs is the one saved after its last successful
+        run, all its `outputs` exist, and none of the steps it requires was
+        just run because of a change. Other steps always run. Use
+        `buildozer --force` to run every step.
+        '''
+        changed = set()
+        ran = []
+        for step in self._sort_build_steps(steps):
+            key = 'cache.{}.step.{}'.format(self.targetname, step.name)
+            fingerprint = None
+            if step.inputs is not None:
+                fingerprint = hashlib.sha1(json.dumps(
+                    step.inputs(), sort_keys=True, default=str
+                ).encode('utf-8')).hexdigest()
+                if (
+                    not self.force_build and
+                    not changed.intersection(step.requires) and
+                    self.state.get(key) == fingerprint and
+                    step.outputs and
+                    all(exists(fn) for fn in step.outputs)
+                ):
+                    self.info('{} (up to date, skipped)'.format(step.title))
+                    self.trace.add(step.name, 'step', perf_counter(), 0,
+                                   skipped=True)
+                    continue
+                if key in self.state:
+                    # forget it until the step succeeds again
+                    del self.state[key]
+
+            self.info(step.title)
+            ran.append(step.name)
+            # the state changes of a step are written once, when it ends
+            with self.state.batch():
+                with self.trace.span(step.name, title=step.title):
+                    step.func()
+
+                if fingerprint is not None:
+                    self.state[key] = fingerprint
+                    changed.add(step.name)
+        return ran
+
+    def _sort_build_steps(self, steps):
+        # topological sort, keeping the declaration order when possible
+        pending = list(steps)
+        names = {step.name for step in pending}
+        done = set()
+        result = []
+        while pending:
+            for step in pending:
+                if all(name in done or name not in names
+                       for name in step.requires):
+                    break
+            else:
+                raise BuildozerException(
+                    'Circular dependency between the build steps {}'.format(
+                        ', '.join(step.name for step in pending)))
+            pending.remove(step)
+            done.add(step.name)
+            result.append(step)
+        return result
+
+    def spec_fingerprint(self):
+        '''Return the content of the configuration (after profile and
+        environment overrides) as a dict, to be used in build step inputs.
+        '''
+        return {section: dict(self.config.items(section, raw=True))
+                for section in self.config.sections()}
+
+    def _check_all_requirements(self):
+        self.check_application_requirements()
+        self.check_garden_requirements()
+
+    def _package_inputs(self):
+        state = self.state
+        manifest = state.get(
+            'cache.{}.app_manifest'.format(self.targetname), {})
+        return {
+            'spec': self.spec_fingerprint(),
+            'build_mode': self.target.build_mode,
+            'artifact_format': self.target.artifact_format,
+            # content only, touching a file must not trigger a new package
+            'sources': {rel: entry[2] for rel, entry in
+                        manifest.get('files', {}).items()},
+            'applibs': [state.get('cache.applibs'),
+                        state.get('cache.applibs_installed')],
+        }
+
     #
     # Log functions
     #
@@ -272,6 +648,8 @@ class Buildozer:
         sensible = kwargs.pop('sensible', False)
         run_condition = kwargs.pop('run_condition', None)
         quiet = kwargs.pop('quiet', False)
+        output_prefix = kwargs.pop('output_prefix', None)
+        process_callback = kwargs.pop('process_callback', None)
 
         if not quiet:
             if not sensible:
@@ -286,45 +664,32 @@ class Buildozer:
         # open the process
         if sys.platform == 'win32':
             kwargs.pop('close_fds', None)
+        if isinstance(command, (list, tuple)):
+            trace_name = command[0]
+        else:
+            trace_name = command.split()[0]
+        trace_args = {'cwd': kwargs.get('cwd')}
+        if not sensible:
+            trace_args['command'] = command
+        start = perf_counter()
         process = Popen(command, **kwargs)
-
-        # prepare fds
-        fd_stdout = process.stdout.fileno()
-        fd_stderr = process.stderr.fileno()
-        if fcntl:
-            fcntl.fcntl(
-                fd_stdout, fcntl.F_SETFL,
-                fcntl.fcntl(fd_stdout, fcntl.F_GETFL) | os.O_NONBLOCK)
-            fcntl.fcntl(
-                fd_stderr, fcntl.F_SETFL,
-                fcntl.fcntl(fd_stderr, fcntl.F_GETFL) | os.O_NONBLOCK)
-
-        ret_stdout = [] if get_stdout else None
-        ret_stderr = [] if get_stderr else None
-        while not run_condition or run_condition():
-            try:
-                readx = select.select([fd_stdout, fd_stderr], [], [], 1)[0]
-            except select.error:
-                break
-            if fd_stdout in readx:
-                chunk = process.stdout.read()
-                if not chunk:
-                    break
-                if get_stdout:
-                    ret_stdout.append(chunk)
-                if show_output:
-                    stdout.write(chunk.decode('utf-8', 'replace'))
-            if fd_stderr in readx:
-                chunk = process.stderr.read()
-                if not chunk:
-                    break
-                if get_stderr:
-                    ret_stderr.append(chunk)
-                if show_output:
-                    stderr.write(chunk.decode('utf-8', 'replace'))
-
-            stdout.flush()
-            stderr.flush()
+        if process_callback:
+            process_callback(process)
+
+        # pump the output, keeping the end of it to explain a failure when
+        # it is not shown
+        pump = OutputPump(tail_size=0 if show_output else self.output_tail_size)
+        out_sink, err_sink = (stdout, stderr) if show_output else (None, None)
+        if show_output and output_prefix:
+            out_sink = PrefixedOutput(stdout, '[{}] '.format(output_prefix))
+            err_sink = PrefixedOutput(stderr, '[{}] '.format(output_prefix))
+        if process.stdout:
+            pump.add(process.stdout, out_sink, capture=get_stdout)
+        if process.stderr:
+            pump.add(process.stderr, err_sink, capture=get_stderr)
+        pump.run(run_condition)
+        ret_stdout = pump.captured(process.stdout)
+        ret_stderr = pump.captured(process.stderr)
 
         try:
             process.communicate(
@@ -332,10 +697,18 @@ class Buildozer:
             )
         except TimeoutExpired:
             pass
+        self.trace.add(os.path.basename(trace_name), 'cmd', start,
+                       perf_counter() - start,
+                       returncode=process.returncode, **trace_args)
 
         if process.returncode != 0 and break_on_error:
             self.error('Command failed: {0}'.format(command))
             self.log_env(self.ERROR, kwargs['env'])
+            output_tail = pump.get_tail()
+            if output_tail:
+                self.error('')
+                self.error('End of the command output:')
+                print(output_tail)
             self.error('')
             self.error('Buildozer failed to execute the last command')
             if self.log_level <= self.INFO:
@@ -348,15 +721,96 @@ class Buildozer:
             self.error('In case of a bug report, please add a full log with log_level = 2')
             raise BuildozerCommandException()
 
-        if ret_stdout:
-            ret_stdout = b''.join(ret_stdout)
-        if ret_stderr:
-            ret_stderr = b''.join(ret_stderr)
-
         return (ret_stdout.decode('utf-8', 'ignore') if ret_stdout else None,
                 ret_stderr.decode('utf-8') if ret_stderr else None,
                 process.returncode)
 
+    def parallel_cmd(self, jobs, max_workers=None):
+        '''Run independent jobs concurrently, and return their results.
+
+        Each job is a `(name, steps)` tuple, where `steps` is a list of
+        `(command, kwargs)` run in order with :meth:`cmd`, or called directly
+        when `command` is a callable. Up to
+        `max_workers` jobs (default: [buildozer] jobs, or the number of
+        CPUs + 4, up to 8) run at the same time, their output lines prefixed with the
+        job name. As soon as a step fails, the other jobs are stopped and
+        a BuildozerCommandException is raised.
+
+        The result of a job is the list of the :meth:`cmd` results of its
+        steps, in the same order as `jobs`.
+        '''
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        if not max_workers:
+            max_workers = int(self.config.getdefault('buildozer', 'jobs', '0'))
+        # most jobs wait on the network or the disk, not on the CPU
+        max_workers = max_workers or min(8, (os.cpu_count() or 1) + 4)
+
+        failed = threading.Event()
+        processes = []
+        # serializes the registration of the processes with the failure, so
+        # a process started while the others are terminated is stopped too
+        lock = threading.Lock()
+
+        def running():
+            return not failed.is_set()
+
+        def register(process):
+            with lock:
+                processes.append(process)
+                if failed.is_set():
+                    process.terminate()
+
+        def fail():
+            # return False if another job already failed
+            with lock:
+                if failed.is_set():
+                    return False
+                failed.set()
+                for process in processes:
+                    if process.poll() is None:
+                        process.terminate()
+                return True
+
+        def run_job(name, steps):
+            results = []
+            for command, kwargs in steps:
+                if failed.is_set():
+                    break
+                if callable(command):
+                    results.append(command(**kwargs))
+                    continue
+                kwargs = dict(kwargs)
+                break_on_error = kwargs.pop('break_on_error', True)
+                kwargs.setdefault('output_prefix', name)
+                result = self.cmd(command, break_on_error=False,
+                                  run_condition=running,
+                                  process_callback=register,
+                                  **kwargs)
+                results.append(result)
+                if result[2] != 0 and break_on_error and fail():
+                    self.error('Command failed in job {}: {}'.format(
+                        name, command))
+                    raise BuildozerCommandException()
+            return results
+
+        self.debug('Run {} jobs, {} at a time'.format(len(jobs), max_workers))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(run_job, name, steps): index
+                       for index, (name, steps) in enumerate(jobs)}
+            results = [None] * len(jobs)
+            error = None
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    fail()
+                    error = error or e
+        if error is not None:
+            raise error
+        return results
+
     def cmd_expect(self, command, **kwargs):
 
         # prepare the environ, based on the system + our own env
@@ -380,11 +834,47 @@ class Buildozer:
         self.debug('Cwd {}'.format(kwargs.get('cwd')))
         return pexpect.spawnu(shlex.join(command), **kwargs)
 
+    def read_spec(self, filename):
+        '''Load the spec file into the configuration, with deprecated tokens
+        migrated. A spec file already parsed by this process, with the same
+        content, is not parsed again.
+        '''
+        with open(filename, 'rb') as fd:
+            content = fd.read()
+        key = (realpath(filename), hashlib.sha1(content).hexdigest())
+        sections = _parsed_specs.get(key)
+        if sections is None:
+            self.config.read_string(content.decode('utf-8'), filename)
+            self.migrate_configuration_tokens()
+            sections = _parsed_specs[key] = {
+                section: {token: self.config.get(section, token, raw=True)
+                          for token in self.config.options(section)}
+                for section in self.config.sections()}
+        else:
+            self.config.read_dict(sections, filename)
+
+    def _configuration_key(self):
+        # the resolved configuration, and the environment variables that
+        # could still override one of its tokens
+        prefixes = tuple('{}_'.format(section.upper())
+                         for section in self.config.sections())
+        env = {key: value for key, value in environ.items()
+               if key.startswith(prefixes)}
+        content = json.dumps([self.spec_fingerprint(), env], sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
     def check_configuration_tokens(self):
         '''Ensure the spec file is 'correct'.
+
+        A configuration is validated once per process: checking it again
+        after it was found valid, for another target or another Buildozer
+        instance, is a no-op.
         '''
-        self.info('Check configuration tokens')
         self.migrate_configuration_tokens()
+        key = self._configuration_key()
+        if key in _validated_configs:
+            return
+        self.info('Check configuration tokens')
         get = self.config.getdefault
         errors = []
         adderror = errors.append
@@ -420,6 +910,7 @@ class Buildozer:
             for error in errors:
                 print(error)
             exit(1)
+        _validated_configs.add(key)
 
     def migrate_configuration_tokens(self):
         config = self.config
@@ -441,34 +932,57 @@ class Buildozer:
                 self.error("In section [app]: {} is deprecated, rename to {}!".format(
                     entry_old, entry_new))
 
+    def _open_state(self):
+        '''Open the build state store, in JSON (state.db) or in SQLite
+        (state.sqlite) depending on the [buildozer] state_backend token.
+        '''
+        filename = join(self.buildozer_dir, 'state.db')
+        backend = self.config.getdefault('buildozer', 'state_backend', 'json')
+        if backend not in ('json', 'sqlite'):
+            self.error('Unknown state_backend {}, use json or sqlite'.format(
+                backend))
+            exit(1)
+        key = (filename, backend)
+        if self.state_stores is not None and key in self.state_stores:
+            return self.state_stores[key]
+        if backend == 'sqlite':
+            store = SqliteStore(join(self.buildozer_dir, 'state.sqlite'),
+                                import_from=filename)
+        else:
+            store = JsonStore(filename)
+        if self.state_stores is not None:
+            self.state_stores[key] = store
+        return store
+
     def check_build_layout(self):
         '''Ensure the build (local and global) directory layout and files are
         ready.
         '''
-        self.info('Ensure build layout')
+        with self.trace.span('layout', cat='layout'):
+            self.info('Ensure build layout')
 
-        if not exists(self.specfilename):
-            print('No {0} found in the current directory. Abandon.'.format(
-                self.specfilename))
-            exit(1)
+            if not exists(self.specfilename):
+                print('No {0} found in the current directory. Abandon.'.format(
+                    self.specfilename))
+                exit(1)
 
-        # create global dir
-        self.mkdir(self.global_buildozer_dir)
-        self.mkdir(self.global_cache_dir)
+            # create global dir
+            self.mkdir(self.global_buildozer_dir)
+            self.mkdir(self.global_cache_dir)
 
-        # create local .buildozer/ dir
-        self.mkdir(self.buildozer_dir)
-        # create local bin/ dir
-        self.mkdir(self.bin_dir)
+            # create local .buildozer/ dir
+            self.mkdir(self.buildozer_dir)
+            # create local bin/ dir
+            self.mkdir(self.bin_dir)
 
-        self.mkdir(self.applibs_dir)
-        self.state = JsonStore(join(self.buildozer_dir, 'state.db'))
+            self.mkdir(self.applibs_dir)
+            self.state = self._open_state()
 
-        target = self.targetname
-        if target:
-            self.mkdir(join(self.global_platform_dir, target, 'platform'))
-            self.mkdir(join(self.buildozer_dir, target, 'platform'))
-            self.mkdir(join(self.buildozer_dir, target, 'app'))
+            target = self.targetname
+            if target:
+                self.mkdir(join(self.global_platform_dir, target, 'platform'))
+                self.mkdir(join(self.buildozer_dir, target, 'platform'))
+                self.mkdir(join(self.buildozer_dir, target, 'app'))
 
     def check_application_requirements(self):
         '''Ensure the application requirements are all available and ready to be
@@ -505,21 +1019,260 @@ class Buildozer:
         self.rmdir(self.applibs_dir)
         self.mkdir(self.applibs_dir)
 
-        # ok now check the availability of all requirements
+        # ok now check the availability of all requirements. Pinned ones found
+        # in the global cache are linked into applibs, all the others are
+        # installed together by a single pip invocation
+        missing = []
+        cached = []
         for requirement in requirements:
-            self._install_application_requirement(requirement)
+            cache_dir = self._requirement_cache_dir(requirement)
+            if cache_dir is not None and exists(cache_dir):
+                cached.append((requirement, cache_dir))
+            else:
+                missing.append(requirement)
+
+        if missing:
+            staging_dir = join(self.buildozer_dir, 'applibs.staging')
+            self.rmdir(staging_dir)
+            report = self._install_application_requirements(
+                missing, staging_dir)
+            self._cache_application_requirements(
+                missing, staging_dir, report)
+            self._link_tree(staging_dir, self.applibs_dir)
+            self.rmdir(staging_dir)
+
+        for requirement, cache_dir in cached:
+            self.debug('Use cached requirement {}'.format(requirement))
+            self._link_distributions(cache_dir, self.applibs_dir)
+
+        # list what applibs ends up with, including the cached requirements
+        installed = sorted(
+            '{}=={}'.format(item['metadata']['name'],
+                            item['metadata']['version'])
+            for item in self._read_distributions(self.applibs_dir)['install'])
 
         # everything goes as expected, save this state!
         self.state['cache.applibs'] = requirements
+        self.state['cache.applibs_installed'] = installed
+
+    def _install_application_requirements(self, requirements, target):
+        '''Install `requirements` into `target` with one pip resolver run,
+        and return pip's installation report (or None if unavailable). With
+        a pip older than 22.2, which has no --report, the report is rebuilt
+        from the distributions found in `target`.
 
-    def _install_application_requirement(self, module):
+        If [app] requirements.wheelhouse is set, packages are only taken
+        from that directory, without hitting any index.
+        '''
         self._ensure_virtualenv()
-        self.debug('Install requirement {} in virtualenv'.format(module))
+        self.debug('Install requirements {} in virtualenv'.format(
+            ', '.join(requirements)))
+        report = join(self.buildozer_dir, 'applibs-report.json')
+        if exists(report):
+            unlink(report)
+        use_report = self._pip_version() >= (22, 2)
+        command = ["pip", "install", f"--target={target}"]
+        if use_report:
+            command.append(f"--report={report}")
+        wheelhouse = self.config.getdefault(
+            'app', 'requirements.wheelhouse', None)
+        if wheelhouse:
+            wheelhouse = realpath(join(self.root_dir, expanduser(wheelhouse)))
+            command += ["--no-index", f"--find-links={wheelhouse}"]
         self.cmd(
-            ["pip", "install", f"--target={self.applibs_dir}", module],
+            command + list(requirements),
             env=self.env_venv,
             cwd=self.buildozer_dir,
         )
+        if not use_report:
+            return self._read_distributions(target)
+        try:
+            with open(report, encoding='utf-8') as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    def _pip_version(self):
+        '''Return the version of the virtualenv pip, as a tuple of ints
+        (empty if it cannot be found out).
+        '''
+        if not hasattr(self, '_venv_pip_version'):
+            stdout = self.cmd(["pip", "--version"], env=self.env_venv,
+                              get_stdout=True, break_on_error=False)[0]
+            match = re.match(r'pip (\d+(?:\.\d+)*)', stdout or '')
+            self._venv_pip_version = tuple(
+                int(part) for part in match.group(1).split('.')) if match else ()
+        return self._venv_pip_version
+
+    def _venv_cache_tag(self):
+        '''Return the implementation cache tag of the virtualenv python
+        (like "cpython-311").
+        '''
+        if not hasattr(self, '_venv_python_tag'):
+            self._ensure_virtualenv()
+            stdout = self.cmd(
+                ["python", "-c",
+                 "import sys; print(sys.implementation.cache_tag)"],
+                env=self.env_venv, get_stdout=True)[0]
+            self._venv_python_tag = stdout.strip()
+        return self._venv_python_tag
+
+    def _read_distributions(self, site_dir):
+        '''Return the metadata of the distributions installed in
+        `site_dir`, in the format of a pip installation report.
+        '''
+        parser = HeaderParser()
+        items = []
+        for fn in sorted(listdir(site_dir)):
+            metadata_fn = join(site_dir, fn, 'METADATA')
+            if not fn.endswith('.dist-info') or not exists(metadata_fn):
+                continue
+            with open(metadata_fn, encoding='utf-8') as fd:
+                headers = parser.parse(fd)
+            items.append({'metadata': {
+                'name': headers['Name'],
+                'version': headers['Version'],
+                'requires_dist': headers.get_all('Requires-Dist') or [],
+            }})
+        return {'install': items}
+
+    def _cache_application_requirements(self, requirements, staging_dir,
+                                        report):
+        '''Store each pinned requirement of a batch install, along with the
+        distributions it depends on, in the global requirement cache.
+        '''
+        if not report:
+            return
+
+        normalize = self._normalize_dist_name
+        dists = {}
+        for item in report.get('install', []):
+            metadata = item.get('metadata', {})
+            if 'name' in metadata:
+                dists[normalize(metadata['name'])] = metadata
+        dist_infos = self._dist_infos(staging_dir)
+
+        for requirement in requirements:
+            cache_dir = self._requirement_cache_dir(requirement)
+            name = requirement.partition('==')[0].strip()
+            if cache_dir is None or '[' in name:
+                # extras pull dependencies we do not track, don't cache them
+                continue
+
+            # gather the distribution and its installed dependencies
+            closure = set()
+            pending = [normalize(name)]
+            while pending:
+                dist = pending.pop()
+                if dist in closure or dist not in dists:
+                    continue
+                closure.add(dist)
+                for dep in dists[dist].get('requires_dist', []):
+                    if re.search(r'\bextra\s*==', dep):
+                        continue
+                    match = re.match(r'[A-Za-z0-9][A-Za-z0-9._-]*', dep)
+                    if match:
+                        pending.append(normalize(match.group()))
+            if not closure or not all(d in dist_infos for d in closure):
+                continue
+
+            if exists(cache_dir):
+                # listed twice, or cached by another project meanwhile
+                continue
+            self.debug('Cache requirement {}'.format(requirement))
+            tmp_dir = '{}.{}.tmp'.format(cache_dir, os.getpid())
+            self.rmdir(tmp_dir)
+            for dist in closure:
+                for rel in self._dist_record(staging_dir, dist_infos[dist]):
+                    dfn = join(tmp_dir, rel)
+                    makedirs(dirname(dfn), exist_ok=True)
+                    self._link_file(join(staging_dir, rel), dfn)
+            try:
+                os.rename(tmp_dir, cache_dir)
+            except OSError:
+                # another process cached it meanwhile
+                rmtree(tmp_dir)
+
+    @staticmethod
+    def _normalize_dist_name(name):
+        return re.sub(r'[-_.]+', '-', name).lower()
+
+    def _dist_infos(self, site_dir):
+        '''Return the .dist-info directories of `site_dir`, by normalized
+        distribution name.
+        '''
+        result = {}
+        for fn in listdir(site_dir):
+            if fn.endswith('.dist-info'):
+                name = fn[:-10].rsplit('-', 1)[0]
+                result[self._normalize_dist_name(name)] = fn
+        return result
+
+    def _link_distributions(self, src, dest):
+        '''Link the distributions installed in `src` into `dest`, each one
+        as a whole. A distribution already in `dest`, in any version, is
+        skipped, so the files of two versions are never mixed.
+        '''
+        present = self._dist_infos(dest)
+        for name, dist_info in sorted(self._dist_infos(src).items()):
+            if name in present:
+                if present[name] != dist_info:
+                    self.debug('Keep {} over the cached {}'.format(
+                        present[name][:-10], dist_info[:-10]))
+                continue
+            for rel in self._dist_record(src, dist_info):
+                dfn = join(dest, rel)
+                makedirs(dirname(dfn), exist_ok=True)
+                if not exists(dfn):
+                    self._link_file(join(src, rel), dfn)
+
+    def _dist_record(self, site_dir, dist_info):
+        '''Yield the paths (relative to `site_dir`) of the files installed by
+        a distribution, as listed in its RECORD.
+        '''
+        with open(join(site_dir, dist_info, 'RECORD'), encoding='utf-8') as fd:
+            for row in csv.reader(fd):
+                if not row:
+                    continue
+                fn = os.path.normpath(join(site_dir, row[0]))
+                if fn.startswith(site_dir + sep) and exists(fn):
+                    yield fn[len(site_dir) + 1:]
+
+    def _requirement_cache_dir(self, requirement):
+        '''Return the global cache directory of a pinned (name==version)
+        requirement for the current target and virtualenv Python, or None if
+        it is not pinned.
+        '''
+        name, sep, version = requirement.partition('==')
+        name, version = name.strip().lower(), version.strip()
+        if not sep or not version:
+            return None
+        # the version of the venv python decides which wheels pip picks
+        key = '{}=={}@{}@{}'.format(name, version,
+                                    self.target.get_requirements_abi(),
+                                    self._venv_cache_tag())
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        return join(self.global_cache_dir, 'applibs',
+                    '{}-{}'.format(self.namify(name), digest))
+
+    def _link_tree(self, src, dest):
+        '''Hardlink every file of `src` into `dest`, copying instead when
+        linking is not possible. Files already in `dest` are kept, as pip
+        does when installing over an existing --target.
+        '''
+        for root, dirs, files in walk(src):
+            target = join(dest, root[len(src) + 1:])
+            makedirs(target, exist_ok=True)
+            for fn in files:
+                dfn = join(target, fn)
+                if not exists(dfn):
+                    self._link_file(join(root, fn), dfn)
+
+    def _link_file(self, src, dest):
+        try:
+            os.link(src, dest)
+        except OSError:
+            copy2(src, dest)
 
     def check_garden_requirements(self):
         garden_requirements = self.config.getlist('app',
@@ -535,20 +1288,14 @@ class Buildozer:
             self.cmd(["python3", "-m", "venv", "./venv"],
                     cwd=self.buildozer_dir)
 
-        # read virtualenv output and parse it
-        output = self.cmd(
-            ["bash", "-c", "source venv/bin/activate && env"],
-            get_stdout=True,
-            cwd=self.buildozer_dir,
-        )
+        # set what venv/bin/activate would: VIRTUAL_ENV, and its bin
+        # directory first in the PATH (no need to spawn a shell for that)
+        bin_dir = 'Scripts' if sys.platform == 'win32' else 'bin'
         self.env_venv = copy(self.environ)
-        for line in output[0].splitlines():
-            args = line.split('=', 1)
-            if len(args) != 2:
-                continue
-            key, value = args
-            if key in ('VIRTUAL_ENV', 'PATH'):
-                self.env_venv[key] = value
+        self.env_venv['VIRTUAL_ENV'] = realpath(self.venv)
+        self.env_venv['PATH'] = os.pathsep.join((
+            join(self.env_venv['VIRTUAL_ENV'], bin_dir),
+            self.environ.get('PATH', environ.get('PATH', os.defpath))))
         if 'PYTHONHOME' in self.env_venv:
             del self.env_venv['PYTHONHOME']
 
@@ -596,40 +1343,125 @@ class Buildozer:
         self.debug('Copy {0} to {1}'.format(source, target))
         copyfile(source, target)
 
-    def file_extract(self, archive, cwd=None):
-        if archive.endswith('.tgz') or archive.endswith('.tar.gz'):
-            self.cmd(["tar", "xzf", archive], cwd=cwd)
-            return
+    def file_extract(self, archive, cwd=None, cache=None):
+        '''Extract `archive` (relative to `cwd`) into `cwd`.
 
-        if archive.endswith('.tbz2') or archive.endswith('.tar.bz2'):
-            # XXX same as before
-            self.cmd(["tar", "xjf", archive], cwd=cwd)
+        Nothing is done if the same archive was already extracted there. If
+        `cache` is set (default to the [buildozer] extract_cache token), the
+        archive is extracted once in the global cache, and its files are
+        copied into `cwd` (as cheap reflinks when the filesystem supports
+        them), so the cache stays intact whatever is done with them.
+        '''
+        if not archive.endswith('.bin') and not is_archive(archive):
+            raise Exception('Unhandled extraction for type {0}'.format(archive))
+        cwd = cwd or os.getcwd()
+        path = join(cwd, archive)
+        if cache is None:
+            cache = self.config.getbooldefault('buildozer', 'extract_cache', False)
+
+        # the hash is only computed again when the archive was modified
+        marker_fn = join(cwd, '.{}.extracted'.format(basename(archive)))
+        marker = {}
+        if exists(marker_fn):
+            with open(marker_fn, encoding='utf-8') as fd:
+                marker = json.load(fd)
+        st = os.stat(path)
+        if (marker.get('size'), marker.get('mtime_ns')) == (
+                st.st_size, st.st_mtime_ns):
+            digest = marker['sha1']
+        else:
+            digest = self._file_digest(path)
+        # without entries, nothing tells the extracted tree is still there
+        if marker.get('sha1') == digest and marker.get('entries') and all(
+                lexists(join(cwd, name)) for name in marker['entries']):
+            self.debug('{} is already extracted'.format(archive))
             return
 
-        if archive.endswith('.bin'):
-            # To process the bin files for linux and darwin systems
-            self.cmd(["chmod", "a+x", archive], cwd=cwd)
-            self.cmd([f"./{archive}"], cwd=cwd)
-            return
+        with self.trace.span(basename(archive), cat='extract'):
+            if archive.endswith('.bin'):
+                # To process the bin files for linux and darwin systems
+                before = set(listdir(cwd))
+                self.cmd(["chmod", "a+x", archive], cwd=cwd)
+                self.cmd([f"./{archive}"], cwd=cwd)
+                entries = sorted((set(listdir(cwd)) - before) |
+                                 set(marker.get('entries', [])))
+            elif cache:
+                entries = self._extract_cached(path, digest, cwd)
+            else:
+                self.debug('Extract {0}'.format(archive))
+                entries = extract_archive(path, cwd, self.extract_workers)
 
-        if archive.endswith('.zip'):
-            self.cmd(["unzip", "-q", join(cwd, archive)], cwd=cwd)
-            return
+        with open(marker_fn, 'w', encoding='utf-8') as fd:
+            json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                       'sha1': digest, 'entries': entries}, fd)
 
-        raise Exception('Unhandled extraction for type {0}'.format(archive))
+    @property
+    def extract_workers(self):
+        return int(self.config.getdefault('buildozer', 'extract_workers', '4'))
+
+    def _extract_cached(self, path, digest, cwd):
+        cache_dir = join(self.global_cache_dir, 'extracted', digest)
+        if not exists(cache_dir):
+            self.debug('Extract {0} into the global cache'.format(path))
+            tmp_dir = '{}.{}.tmp'.format(cache_dir, os.getpid())
+            if exists(tmp_dir):
+                rmtree(tmp_dir)
+            extract_archive(path, tmp_dir, self.extract_workers)
+            try:
+                os.rename(tmp_dir, cache_dir)
+            except OSError:
+                # another process extracted it meanwhile
+                rmtree(tmp_dir)
+        self.debug('Copy {0} from the global cache'.format(basename(path)))
+        self._copy_extracted(cache_dir, cwd)
+        return sorted(listdir(cache_dir))
+
+    def _copy_extracted(self, src, dest):
+        '''Reproduce the `src` tree in `dest`, with copies of its files and
+        symlinks. Existing files are removed first: they may be hardlinks
+        into the cache, made by an older buildozer, that must not be
+        written through.
+        '''
+        pairs = []
+        for root, dirs, files in walk(src):
+            target = join(dest, root[len(src) + 1:])
+            makedirs(target, exist_ok=True)
+            for dn in dirs[:]:
+                if islink(join(root, dn)):
+                    dirs.remove(dn)
+                    files.append(dn)
+            for fn in files:
+                sfn = join(root, fn)
+                dfn = join(target, fn)
+                if lexists(dfn):
+                    unlink(dfn)
+                if islink(sfn):
+                    os.symlink(os.readlink(sfn), dfn)
+                else:
+                    pairs.append((sfn, dfn))
+        self.file_copier.copy_files(pairs, preserve=True)
 
-    def file_copytree(self, src, dest):
-        print('copy {} to {}'.format(src, dest))
+    def file_copytree(self, src, dest, preserve=False, symlinks=False,
+                      update=False):
+        '''Copy the `src` tree (or file) into `dest`. See
+        :meth:`buildozer.filecopy.FileCopier.copytree` for the options.
+        '''
+        self.debug('Copy {} to {}'.format(src, dest))
         if os.path.isdir(src):
-            if not os.path.isdir(dest):
-                os.makedirs(dest)
-            files = os.listdir(src)
-            for f in files:
-                self.file_copytree(
-                    os.path.join(src, f),
-                    os.path.join(dest, f))
+            return self.file_copier.copytree(src, dest, preserve=preserve,
+                                             symlinks=symlinks, update=update)
+        if preserve:
+            copy2(src, dest)
         else:
             copyfile(src, dest)
+        return 1
+
+    @property
+    def file_copier(self):
+        if self._file_copier is None:
+            workers = int(self.config.getdefault('buildozer', 'copy_workers', '0'))
+            self._file_copier = FileCopier(workers)
+        return self._file_copier
 
     def clean_platform(self):
         self.info('Clean the platform build directory')
@@ -637,26 +1469,56 @@ class Buildozer:
             return
         rmtree(self.platform_dir)
 
-    def download(self, url, filename, cwd=None):
-        def report_hook(index, blksize, size):
-            if size <= 0:
-                progression = '{0} bytes'.format(index * blksize)
-            else:
-                progression = '{0:.2f}%'.format(
-                        index * blksize * 100. / float(size))
-            if "CI" not in environ:
-                stdout.write('- Download {}\r'.format(progression))
-                stdout.flush()
-
-        url = url + filename
-        if cwd:
-            filename = join(cwd, filename)
-        if self.file_exists(filename):
-            unlink(filename)
+    @property
+    def download_manager(self):
+        if self._download_manager is None:
+            self._download_manager = DownloadManager(
+                join(self.global_cache_dir, 'downloads'),
+                mirrors=self.config.getlist('buildozer', 'download_mirrors', []),
+                workers=int(self.config.getdefault(
+                    'buildozer', 'download_workers', '4')),
+                progress=self._download_progress)
+        return self._download_manager
+
+    def _download_progress(self, url, downloaded, total):
+        if "CI" in environ:
+            return
+        if total <= 0:
+            progression = '{0} bytes'.format(downloaded)
+        else:
+            progression = '{0:.2f}%'.format(downloaded * 100. / total)
+        stdout.write('- Download {} {}\r'.format(
+            url.rsplit('/', 1)[-1], progression))
+        stdout.flush()
+
+    def download(self, url, filename, cwd=None, checksum=None):
+        '''Download `url` + `filename` into `cwd`, through the download
+        cache. `checksum` ("sha256:<hexdigest>", or any other hashlib
+        algorithm) is verified before the file is used.
+        '''
+        return self.download_many([(url, filename, checksum)], cwd)[0]
 
-        self.debug('Downloading {0}'.format(url))
-        urlretrieve(url, filename, report_hook)
-        return filename
+    def download_many(self, downloads, cwd=None):
+        '''Download concurrently every (url, filename, checksum) of
+        `downloads` into `cwd`, and return the downloaded filenames.
+        '''
+        items = []
+        targets = []
+        for url, filename, checksum in downloads:
+            url = url + filename
+            if cwd:
+                filename = join(cwd, filename)
+            if self.file_exists(filename):
+                unlink(filename)
+            self.debug('Downloading {0}'.format(url))
+            items.append((url, checksum))
+            targets.append(filename)
+
+        cached = self.download_manager.fetch_many(items)
+        for source, filename in zip(cached, targets):
+            # copy, the cached file must stay intact whatever happens to this one
+            copy_file(source, filename)
+        return targets
 
     def get_version(self):
         c = self.config
@@ -694,113 +1556,134 @@ class Buildozer:
         raise Exception('Missing version or version.regex + version.filename')
 
     def build_application(self):
-        self._copy_application_sources()
-        self._copy_application_libs()
+        with self.trace.span('copy sources', cat='app'):
+            self._copy_application_sources()
+        with self.trace.span('copy applibs', cat='app'):
+            self._copy_application_libs()
         self._add_sitecustomize()
 
     def _copy_application_sources(self):
-        # XXX clean the inclusion/exclusion algo.
         source_dir = realpath(expanduser(self.config.getdefault('app', 'source.dir', '.')))
-        include_exts = self.config.getlist('app', 'source.include_exts', '')
-        exclude_exts = self.config.getlist('app', 'source.exclude_exts', '')
-        exclude_dirs = self.config.getlist('app', 'source.exclude_dirs', '')
-        exclude_patterns = self.config.getlist('app', 'source.exclude_patterns', '')
-        include_patterns = self.config.getlist('app',
-                                               'source.include_patterns',
-                                               '')
+        source_filter = SourceFilter.from_config(self.config)
         app_dir = self.app_dir
 
-        include_exts = [ext.lower() for ext in include_exts]
-        exclude_exts = [ext.lower() for ext in exclude_exts]
-        exclude_dirs = [dir.lower() for dir in exclude_dirs]
-        exclude_patterns = [pat.lower() for pat in exclude_patterns]
-        include_patterns = [pat.lower() for pat in include_patterns]
-
         self.debug('Copy application source from {}'.format(source_dir))
 
-        rmtree(self.app_dir)
-
-        for root, dirs, files in walk(source_dir, followlinks=True):
-            # avoid hidden directory
-            if True in [x.startswith('.') for x in root.split(sep)]:
-                continue
-
-            # need to have sort-of normalization. Let's say you want to exclude
-            # image directory but not images, the filtered_root must have a / at
-            # the end, same for the exclude_dir. And then we can safely compare
-            filtered_root = root[len(source_dir) + 1:].lower()
-            if filtered_root:
-                filtered_root += '/'
-
-                # manual exclude_dirs approach
-                is_excluded = False
-                for exclude_dir in exclude_dirs:
-                    if exclude_dir[-1] != '/':
-                        exclude_dir += '/'
-                    if filtered_root.startswith(exclude_dir):
-                        is_excluded = True
-                        break
-
-                # pattern matching
-                if not is_excluded:
-                    # match pattern if not ruled out by exclude_dirs
-                    for pattern in exclude_patterns:
-                        if fnmatch(filtered_root, pattern):
-                            is_excluded = True
-                            break
-                for pattern in include_patterns:
-                    if fnmatch(filtered_root, pattern):
-                        is_excluded = False
-                        break
-
-                if is_excluded:
-                    continue
-
+        # the manifest maps each copied file (relative to app_dir) to the
+        # [size, mtime_ns, sha1] of its source, so only changes are synced
+        manifest_key = 'cache.{}.app_manifest'.format(self.targetname)
+        previous = self.state.get(manifest_key, {})
+        if previous.get('source_dir') != source_dir or not exists(app_dir):
+            previous = {}
+            self.rmdir(app_dir)
+            self.mkdir(app_dir)
+        old_files = previous.get('files', {})
+        new_files = {}
+        to_copy = []
+        changes = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+        for root, files in source_filter.walk(source_dir):
             for fn in files:
-                # avoid hidden files
-                if fn.startswith('.'):
-                    continue
-
-                # pattern matching
-                is_excluded = False
-                dfn = fn.lower()
-                if filtered_root:
-                    dfn = join(filtered_root, fn)
-                for pattern in exclude_patterns:
-                    if fnmatch(dfn, pattern):
-                        is_excluded = True
-                        break
-                for pattern in include_patterns:
-                    if fnmatch(dfn, pattern):
-                        is_excluded = False
-                        break
-                if is_excluded:
-                    continue
-
-                # filter based on the extension
-                # TODO more filters
-                basename, ext = splitext(fn)
-                if ext:
-                    ext = ext[1:].lower()
-                    if include_exts and ext not in include_exts:
+                sfn = join(root, fn)
+                rel = join(root[len(source_dir) + 1:], fn)
+                rfn = realpath(join(app_dir, rel))
+
+                # skip files whose stat, or failing that content, is unchanged
+                st = os.stat(sfn)
+                entry = old_files.get(rel)
+                if entry and exists(rfn):
+                    if entry[:2] == [st.st_size, st.st_mtime_ns]:
+                        new_files[rel] = entry
+                        changes['unchanged'] += 1
                         continue
-                    if exclude_exts and ext in exclude_exts:
+                    digest = self._file_digest(sfn)
+                    if entry[2] == digest:
+                        new_files[rel] = [st.st_size, st.st_mtime_ns, digest]
+                        changes['unchanged'] += 1
                         continue
+                else:
+                    digest = self._file_digest(sfn)
 
-                sfn = join(root, fn)
-                rfn = realpath(join(app_dir, root[len(source_dir) + 1:], fn))
+                self.debug('Copy {0}'.format(sfn))
+                to_copy.append((sfn, rfn))
+                new_files[rel] = [st.st_size, st.st_mtime_ns, digest]
+                changes['updated' if entry else 'added'] += 1
 
-                # ensure the directory exists
-                dfn = dirname(rfn)
-                self.mkdir(dfn)
+        # copy!
+        self.file_copier.copy_files(to_copy)
 
-                # copy!
-                self.debug('Copy {0}'.format(sfn))
-                copyfile(sfn, rfn)
+        # remove the files that are gone from the source (or now excluded)
+        for rel in old_files:
+            if rel in new_files:
+                continue
+            rfn = join(app_dir, rel)
+            if exists(rfn):
+                self.debug('Remove {0}'.format(rfn))
+                unlink(rfn)
+                self._remove_empty_dirs(dirname(rfn), app_dir)
+            changes['removed'] += 1
+
+        self.state[manifest_key] = {'source_dir': source_dir,
+                                    'files': new_files}
+        self.info('Application sources: {added} added, {updated} updated, '
+                  '{removed} removed, {unchanged} unchanged'.format(**changes))
+        return changes
+
+    def watch(self, package=False, poll=False, debounce=0.3):
+        '''Sync the application sources into the app directory each time
+        they change, until interrupted. With `package`, the package is built
+        again as well. Bursts of changes closer than `debounce` seconds
+        trigger a single rebuild.
+        '''
+        source_dir = realpath(expanduser(self.config.getdefault('app', 'source.dir', '.')))
+        source_filter = SourceFilter.from_config(self.config)
+
+        def rebuild():
+            try:
+                if package:
+                    self.target.__dict__.pop('_build_done', None)
+                    self.build()
+                else:
+                    with self.state.batch():
+                        self._copy_application_sources()
+            except BuildozerException as e:
+                # keep watching, the next change may fix it
+                self.error('Rebuild failed: {}'.format(e.args[0] if e.args else e))
+            except SystemExit as e:
+                # many errors are reported, then exit(1)
+                self.error('Rebuild failed (exit code {})'.format(e.code))
+
+        interval = float(self.config.getdefault('buildozer', 'watch_interval', '1'))
+        watcher = create_watcher(source_dir, source_filter, poll=poll,
+                                 interval=interval)
+        self.info('Watch {} ({}), press Ctrl-C to stop'.format(
+            source_dir, type(watcher).__name__))
+        rebuild()
+        try:
+            watch_changes(watcher, rebuild, debounce)
+        except KeyboardInterrupt:
+            print('')
+
+    def _file_digest(self, fn):
+        sha1 = hashlib.sha1()
+        with open(fn, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _remove_empty_dirs(self, dn, stop_dir):
+        while dn != stop_dir and dn.startswith(stop_dir):
+            try:
+                os.rmdir(dn)
+            except OSError:
+                return
+            dn = dirname(dn)
 
     def _copy_application_libs(self):
         # copy also the libs
-        copytree(self.applibs_dir, join(self.app_dir, '_applibs'))
+        dest = join(self.app_dir, '_applibs')
+        self.rmdir(dest)
+        self.file_copier.copytree(self.applibs_dir, dest, preserve=True)
 
     def _add_sitecustomize(self):
         copyfile(join(dirname(__file__), 'sitecustomize.py'),
@@ -815,6 +1698,9 @@ class Buildozer:
                    b'"..", "_applibs")] + sys.path\n')
         with open(main_py, 'rb') as fd:
             data = fd.read()
+        if data.startswith(header):
+            # unchanged since the last build, already patched
+            return
         data = header + data
         with open(main_py, 'wb') as fd:
             fd.write(data)
@@ -828,11 +1714,15 @@ class Buildozer:
 
     @property
     def root_dir(self):
-        return realpath(expanduser(dirname(self.specfilename)))
+        return self._cached_path('root_dir', lambda: realpath(
+            expanduser(dirname(self.specfilename))))
 
     @property
     def user_build_dir(self):
         """The user-provided build dir, if any."""
+        return self._cached_path('user_build_dir', self._get_user_build_dir)
+
+    def _get_user_build_dir(self):
         # Check for a user-provided build dir
         # Check the (deprecated) builddir token, for backwards compatibility
         build_dir = self.config.getdefault('buildozer', 'builddir', None)
@@ -849,9 +1739,18 @@ class Buildozer:
     @property
     def buildozer_dir(self):
         '''The directory in which to run the app build.'''
-        if self.user_build_dir is not None:
-            return self.user_build_dir
-        return join(self.root_dir, '.buildozer')
+        return self._cached_path('buildozer_dir', lambda: (
+            self.user_build_dir if self.user_build_dir is not None
+            else join(self.root_dir, '.buildozer')))
+
+    def _cached_path(self, name, resolve):
+        # paths derived from the config are kept until the config changes
+        key = ('path', name)
+        try:
+            return self._config_cache[key]
+        except KeyError:
+            path = self._config_cache[key] = resolve()
+            return path
 
     @property
     def bin_dir(self):
@@ -900,35 +1799,31 @@ class Buildozer:
     #
 
     def targets(self):
-        for fn in listdir(join(dirname(__file__), 'targets')):
-            if fn.startswith('.') or fn.startswith('__'):
-                continue
-            if not fn.endswith('.py'):
-                continue
-            target = fn[:-3]
+        for info in self.target_infos():
             try:
-                m = __import__('buildozer.targets.{0}'.format(target),
-                        fromlist=['buildozer'])
-                yield target, m
+                yield info.name, info.load()
             except NotImplementedError:
                 pass
-            except:
-                raise
-                pass
+
+    def target_infos(self):
+        '''Return the :class:`buildozer.target.TargetInfo` of the targets
+        available on this platform, without importing them.
+        '''
+        return [info for info in discover_targets() if info.available]
 
     def usage(self):
         print('Usage:')
-        print('    buildozer [--profile <name>] [--verbose] [target] <command>...')
+        print('    buildozer [--profile <name>] [--verbose] [--force] [target] <command>...')
         print('    buildozer --version')
         print('')
         print('Available targets:')
-        targets = list(self.targets())
-        for target, m in targets:
+        targets = self.target_infos()
+        for info in targets:
             try:
-                doc = m.__doc__.strip().splitlines()[0].strip()
+                doc = info.doc.strip().splitlines()[0].strip()
             except Exception:
                 doc = '<no description>'
-            print('  {0:<18} {1}'.format(target, doc))
+            print('  {0:<18} {1}'.format(info.name, doc))
 
         print('')
         print('Global commands (without target):')
@@ -951,14 +1846,14 @@ class Buildozer:
         print('  deploy     Deploy the application on the device')
         print('  run        Run the application on the device')
         print('  serve      Serve the bin directory via SimpleHTTPServer')
+        print('  watch      Sync the sources on change (--package to rebuild)')
 
-        for target, m in targets:
-            mt = m.get_target(self)
-            commands = mt.get_custom_commands()
+        for info in targets:
+            commands = info.get_custom_commands(self.standard_cmds)
             if not commands:
                 continue
             print('')
-            print('Target "{0}" commands:'.format(target))
+            print('Target "{0}" commands:'.format(info.name))
             for command, doc in commands:
                 if not doc:
                     continue
@@ -994,6 +1889,9 @@ class Buildozer:
             elif arg in ('-p', '--profile'):
                 self.config_profile = args.pop(0)
 
+            elif arg in ('-f', '--force'):
+                self.force_build = True
+
             elif arg == '--version':
                 print('Buildozer {0}'.format(__version__))
                 exit(0)
@@ -1015,13 +1913,27 @@ class Buildozer:
             return
 
         # maybe it's a target?
-        targets = [x[0] for x in self.targets()]
+        targets = [info.name for info in self.target_infos()]
         if command not in targets:
             print('Unknown command/target {}'.format(command))
             exit(1)
 
         self.set_target(command)
-        self.target.run_commands(args)
+        try:
+            self.target.run_commands(args)
+        finally:
+            self.save_trace()
+
+    def save_trace(self):
+        '''Save the timings of the build steps and commands run so far, for
+        `buildozer profile`.
+        '''
+        if not any(event['cat'] == 'step' for event in self.trace.events):
+            return
+        if not exists(self.buildozer_dir):
+            return
+        filename = self.trace.save(join(self.buildozer_dir, 'profile'))
+        self.debug('Build profile saved to {}'.format(filename))
 
     def check_root(self):
         '''If effective user id is 0, display a warning and require
@@ -1097,6 +2009,52 @@ class Buildozer:
         '''
         print('Buildozer {0}'.format(__version__))
 
+    def cmd_daemon(self, *args):
+        '''Serve the commands of this project from a background process (stop, status)
+        '''
+        from buildozer import daemon
+        path = daemon.socket_path(self.root_dir)
+        action = args[0] if args else 'start'
+        if action == 'stop':
+            if not daemon.stop(path):
+                print('No daemon running.')
+        elif action == 'status':
+            if daemon.ping(path):
+                print('Daemon running on {}'.format(path))
+            else:
+                print('No daemon running.')
+                exit(1)
+        elif action == 'start':
+            daemon.BuildozerDaemon(self.root_dir, path).serve_forever()
+        else:
+            self.error('Unknown daemon action {}, use start, stop or status'.format(
+                action))
+            exit(1)
+
+    def cmd_profile(self, *args):
+        '''Show the time spent in each step of the last build
+        '''
+        filename = join(self.buildozer_dir, 'profile', 'profile.json')
+        if not exists(filename):
+            print('No build profile found, run a build first.')
+            exit(1)
+        with open(filename, encoding='utf-8') as fd:
+            profile = json.load(fd)
+
+        print('Last build: {} ({:.1f}s)'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(profile['started'])),
+            profile['duration']))
+        print('')
+        print('  {0:<8} {1:<40} {2:>5} {3:>9}'.format(
+            'Kind', 'Name', 'Runs', 'Time'))
+        for cat, name, count, duration in summarize(profile):
+            print('  {0:<8} {1:<40} {2:>5} {3:>8.2f}s'.format(
+                cat, name[:40], count, duration))
+        print('')
+        print('Chrome trace: {}'.format(
+            join(self.buildozer_dir, 'profile', 'profile.trace.json')))
+
     def cmd_serve(self, *args):
         '''Serve the bin directory via SimpleHTTPServer
         '''
@@ -1150,57 +2108,92 @@ class Buildozer:
         kwargs['with_values'] = True
         return self._get_config_list(*args, **kwargs)
 
-    def _get_config_list(self, section, token, default=None, with_values=False):
+    def _set_config(self, section, token, value=None):
         # monkey-patch method for ConfigParser
-        # get a key as a list of string, separated from the comma
+        # setting a value invalidates every resolved value and path
+        if (self.config.has_option(section, token) and
+                self.config.get(section, token, raw=True) == value):
+            return
+        self._config_cache.clear()
+        ConfigParser.set(self.config, section, token, value)
+
+    def _remove_config_option(self, section, token):
+        # monkey-patch method for ConfigParser
+        self._config_cache.clear()
+        return ConfigParser.remove_option(self.config, section, token)
+
+    def _get_config_value(self, section, token):
+        '''Return the value of a token, with its environment variable
+        override applied, or _MISSING. The environment is only looked up the
+        first time a token is read after the config was modified.
+        '''
+        key = ('value', section, token)
+        try:
+            return self._config_cache[key]
+        except KeyError:
+            pass
 
         # check if an env var exists that should replace the file config
         set_config_token_from_env(section, token, self.config)
 
+        if self.config.has_option(section, token):
+            value = self.config.get(section, token)
+        else:
+            value = _MISSING
+        self._config_cache[key] = value
+        return value
+
+    def _get_config_list(self, section, token, default=None, with_values=False):
+        # monkey-patch method for ConfigParser
+        # get a key as a list of string, separated from the comma
+        key = ('list', section, token, with_values)
+        try:
+            values = self._config_cache[key]
+        except KeyError:
+            values = self._config_cache[key] = self._resolve_config_list(
+                section, token, with_values)
+        if values is None:
+            return default
+        # callers are free to modify the list they get
+        return list(values)
+
+    def _resolve_config_list(self, section, token, with_values):
+        # the env var is checked first, even if a section:token exists
+        value = self._get_config_value(section, token)
+
         # if a section:token is defined, let's use the content as a list.
         l_section = '{}:{}'.format(section, token)
         if self.config.has_section(l_section):
             values = self.config.options(l_section)
             if with_values:
-                return ['{}={}'.format(key, self.config.get(l_section, key)) for
-                        key in values]
+                return tuple('{}={}'.format(key, self.config.get(l_section, key))
+                             for key in values)
             else:
-                return [x.strip() for x in values]
+                return tuple(x.strip() for x in values)
 
-        values = self.config.getdefault(section, token, '')
-        if not values:
-            return default
-        values = values.split(',')
-        if not values:
-            return default
-        return [x.strip() for x in values]
+        if value is _MISSING or not value:
+            return None
+        return tuple(x.strip() for x in value.split(','))
 
     def _get_config_default(self, section, token, default=None):
         # monkey-patch method for ConfigParser
         # get an appropriate env var if it exists, else
         # get a key in a section, or the default
-
-        # check if an env var exists that should replace the file config
-        set_config_token_from_env(section, token, self.config)
-
-        if not self.config.has_section(section):
-            return default
-        if not self.config.has_option(section, token):
+        value = self._get_config_value(section, token)
+        if value is _MISSING:
             return default
-        return self.config.get(section, token)
+        return value
 
     def _get_config_bool(self, section, token, default=False):
         # monkey-patch method for ConfigParser
         # get a key in a section, or the default
-
-        # check if an env var exists that should replace the file config
-        set_config_token_from_env(section, token, self.config)
-
-        if not self.config.has_section(section):
+        value = self._get_config_value(section, token)
+        if value is _MISSING:
             return default
-        if not self.config.has_option(section, token):
-            return default
-        return self.config.getboolean(section, token)
+        try:
+            return self.config.BOOLEAN_STATES[value.lower()]
+        except KeyError:
+            raise ValueError('Not a boolean: {}'.format(value))
 
     def _get_config_raw_default(self, section, token, default=None, section_sep="=", split_char=" "):
         l_section = '{}:{}'.format(section, token)
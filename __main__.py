@@ -44,6 +44,7 @@ from kivy.uix.screenmanager import (
 
 
 import os
+import time
 # Modern Color Scheme
 COLORS = {
     'primary': '#70B4B8',  # Indigo
@@ -353,15 +354,53 @@ class BaseDisplayFrame(BaseFrame):
         pass
 
 # ===== MODERN COMPONENTS =====
+class Throttle:
+    """Deliver the latest value of a high-frequency event at a bounded rate"""
+
+    def __init__(self, widget, callback, interval_ms=100):
+        self.widget = widget
+        self.callback = callback
+        self.interval_ms = interval_ms
+        self._pending = None
+        self._after_id = None
+        self._last_call = 0.0
+
+    def __call__(self, *args):
+        """Queue a call; only the most recent arguments are delivered"""
+        self._pending = args
+        if self._after_id is None:
+            elapsed_ms = (time.monotonic() - self._last_call) * 1000
+            delay = max(0, int(self.interval_ms - elapsed_ms))
+            self._after_id = self.widget.after(delay, self._fire)
+
+    def flush(self, *args):
+        """Deliver any pending call right away (e.g. on release)"""
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._fire()
+
+    def _fire(self):
+        self._after_id = None
+        if self._pending is None:
+            return
+        args, self._pending = self._pending, None
+        self._last_call = time.monotonic()
+        self.callback(*args)
+
+
 class ModernSlider(ctk.CTkFrame):
     """Modern weight slider with improved design"""
 
+    CHANGE_INTERVAL_MS = 100
+
     def __init__(self, parent, component_name: str, initial_weight: float = 0.0, on_change=None):
         super().__init__(parent, fg_color=COLORS['surface'], corner_radius=16)
         self.component_name = component_name
         self.weight_value = initial_weight
         self.on_change_callback = on_change
         self.is_updating = False
+        self.change_throttle = Throttle(self, self._notify_change, self.CHANGE_INTERVAL_MS)
         self.setup_component()
 
     def setup_component(self):
@@ -404,6 +443,7 @@ class ModernSlider(ctk.CTkFrame):
         )
         self.slider.set(self.weight_value)
         self.slider.grid(row=0, column=2, padx=12, pady=16, sticky="ew")
+        self.slider.bind("<ButtonRelease-1>", self.change_throttle.flush)
 
         self.increase_btn = ModernButton(
             self,
@@ -436,20 +476,32 @@ class ModernSlider(ctk.CTkFrame):
 
     def on_slider_change(self, value):
         if not self.is_updating:
-            self.update_weight(value)
+            self.update_weight(value, final=False)
+
+    def update_weight(self, new_value, final=True):
+        """Update weight with visual feedback for over-limit
 
-    def update_weight(self, new_value):
-        """Update weight with visual feedback for over-limit"""
+        While dragging (final=False) the change callback is throttled to
+        CHANGE_INTERVAL_MS; the last value is flushed on release.
+        """
         self.is_updating = True
         self.weight_value = new_value
         self.slider.set(new_value)
-        self.weight_label.configure(text=f"{new_value:.0f}%")
+
+        text = f"{new_value:.0f}%"
+        if self.weight_label.cget("text") != text:
+            self.weight_label.configure(text=text)
 
         if self.on_change_callback:
-            self.on_change_callback(self.component_name, new_value)
+            self.change_throttle(new_value)
+            if final:
+                self.change_throttle.flush()
 
         self.is_updating = False
 
+    def _notify_change(self, value):
+        self.on_change_callback(self.component_name, value)
+
 class ModernLoginFrame(BaseInputFrame):
     """Modern login screen"""
 
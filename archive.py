@@ -0,0 +1,141 @@
+'''
+Archive extraction
+==================
+
+Extract tar and zip archives in-process. The members of a zip archive are
+independent, so they are decompressed by a pool of threads (zlib releases
+the GIL); a compressed tar archive is a single stream and is extracted
+sequentially.
+
+Unlike zipfile's own extraction, unix permissions and symlinks stored in
+zip archives are restored, as unzip does. Whatever stands where a member
+is extracted (a symlink, a file, a directory in the way) is removed first,
+so a tree extracted before is never written through.
+'''
+
+import os
+import stat
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from buildozer.filecopy import clear_destination
+
+TAR_SUFFIXES = ('.tgz', '.tar.gz', '.tbz2', '.tar.bz2', '.txz', '.tar.xz',
+                '.tar')
+ZIP_SUFFIXES = ('.zip', )
+
+
+def is_archive(filename):
+    return filename.endswith(TAR_SUFFIXES + ZIP_SUFFIXES)
+
+
+def extract_archive(archive, dest, workers=4):
+    '''Extract `archive` into `dest`, and return the names of the top-level
+    entries it contains.
+    '''
+    os.makedirs(dest, exist_ok=True)
+    if archive.endswith(ZIP_SUFFIXES):
+        return _extract_zip(archive, dest, workers)
+    if archive.endswith(TAR_SUFFIXES):
+        return _extract_tar(archive, dest)
+    raise Exception('Unhandled extraction for type {0}'.format(archive))
+
+
+def _name_parts(name):
+    # "./a//b/" and "/a/b" both name a/b inside the destination
+    return [part for part in name.split('/')
+            if part not in ('', '.')]
+
+
+def _top_level(names):
+    return sorted({parts[0] for parts in map(_name_parts, names)
+                   if parts and parts[0] != '..'})
+
+
+def _clear_member(dest, name, is_dir):
+    parts = _name_parts(name)
+    if not parts or '..' in parts:
+        # not extracted inside dest, never remove anything for it
+        return
+    path = os.path.join(dest, *parts)
+    root = os.path.realpath(dest)
+    parent = os.path.realpath(os.path.dirname(path))
+    if parent != root and not parent.startswith(root + os.sep):
+        # a symlinked parent leads out of dest, leave that alone
+        return
+    if is_dir:
+        # an existing directory is kept, anything else is replaced
+        if os.path.islink(path) or (os.path.lexists(path) and
+                                    not os.path.isdir(path)):
+            clear_destination(path, keep_file=False)
+    else:
+        clear_destination(path, keep_file=False)
+
+
+def _extract_tar(archive, dest):
+    with tarfile.open(archive, 'r:*') as tf:
+        members = tf.getmembers()
+        for member in members:
+            _clear_member(dest, member.name, member.isdir())
+        if hasattr(tarfile, 'tar_filter'):
+            # refuse absolute paths and members outside of dest, but keep
+            # the permissions of the toolchains
+            tf.extractall(dest, members, filter='tar')
+        else:
+            tf.extractall(dest, members)
+    return _top_level(member.name for member in members)
+
+
+def _zip_mode(info):
+    return info.external_attr >> 16
+
+
+def _extract_zip_members(archive, names, dest):
+    with zipfile.ZipFile(archive) as zf:
+        for name in names:
+            info = zf.getinfo(name)
+            mode = _zip_mode(info)
+            _clear_member(dest, name, False)
+            # zipfile sanitizes the member name into a path inside dest
+            try:
+                path = zf.extract(info, dest)
+            except FileExistsError:
+                # another worker created the same parent directory meanwhile
+                path = zf.extract(info, dest)
+            if stat.S_ISLNK(mode):
+                # the content of a symlink member is its target
+                target = zf.read(info).decode('utf-8')
+                os.unlink(path)
+                os.symlink(target, path)
+            elif mode & 0o777:
+                os.chmod(path, mode & 0o777)
+
+
+def _extract_zip(archive, dest, workers):
+    with zipfile.ZipFile(archive) as zf:
+        infos = zf.infolist()
+        for info in infos:
+            if info.is_dir():
+                _clear_member(dest, info.filename, True)
+        # create the directories first, the files are then written in any
+        # order
+        dirs = [(zf.extract(info, dest), _zip_mode(info))
+                for info in infos if info.is_dir()]
+    files = [info.filename for info in infos if not info.is_dir()]
+
+    if workers <= 1 or len(files) < 16:
+        _extract_zip_members(archive, files, dest)
+    else:
+        # interleave the members so that each worker gets a similar load
+        chunks = [files[index::workers * 4] for index in range(workers * 4)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_zip_members, archive, chunk,
+                                       dest) for chunk in chunks if chunk]
+            for future in futures:
+                future.result()
+
+    # restore the directory permissions last, they may forbid writing
+    for path, mode in dirs:
+        if mode & 0o777:
+            os.chmod(path, mode & 0o777)
+    return _top_level(info.filename for info in infos)
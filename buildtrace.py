@@ -0,0 +1,99 @@
+'''
+Build trace
+===========
+
+Record how long each build step and command takes, and save it both as a
+plain JSON profile and in the Chrome trace event format (open it in
+chrome://tracing or https://ui.perfetto.dev).
+'''
+
+import os
+import json
+import threading
+from time import time, perf_counter
+from contextlib import contextmanager
+from os.path import join
+
+
+class BuildTrace:
+
+    def __init__(self):
+        self.started = time()
+        self.origin = perf_counter()
+        self.events = []
+
+    @contextmanager
+    def span(self, name, cat='step', **args):
+        '''Time the enclosed block as an event `name` of category `cat`.
+        '''
+        start = perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            self.add(name, cat, start, perf_counter() - start, **args)
+
+    def add(self, name, cat, start, duration, **args):
+        self.events.append({
+            'name': name,
+            'cat': cat,
+            'start': start - self.origin,
+            'duration': duration,
+            'thread': threading.get_ident(),
+            'args': args,
+        })
+
+    def save(self, directory):
+        '''Write `profile.json` and `profile.trace.json` into `directory`,
+        and return the path of the first one.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        events = sorted(self.events, key=lambda event: event['start'])
+        profile = {
+            'started': self.started,
+            'duration': perf_counter() - self.origin,
+            'events': [
+                {key: event[key] for key in
+                 ('name', 'cat', 'start', 'duration', 'args')}
+                for event in events],
+        }
+        filename = join(directory, 'profile.json')
+        with open(filename, 'w', encoding='utf-8') as fd:
+            json.dump(profile, fd, indent=1, default=str)
+
+        threads = {}
+        pid = os.getpid()
+        trace_events = []
+        for event in events:
+            tid = threads.setdefault(event['thread'], len(threads) + 1)
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['cat'],
+                'ph': 'X',
+                'ts': round(event['start'] * 1e6),
+                'dur': round(event['duration'] * 1e6),
+                'pid': pid,
+                'tid': tid,
+                'args': event['args'],
+            })
+        with open(join(directory, 'profile.trace.json'), 'w',
+                  encoding='utf-8') as fd:
+            json.dump({'traceEvents': trace_events,
+                       'displayTimeUnit': 'ms'}, fd, default=str)
+        return filename
+
+
+def summarize(profile):
+    '''Return the (category, name, count, total duration) of the events in
+    a saved profile, aggregated by name and sorted by decreasing duration.
+    '''
+    totals = {}
+    for event in profile.get('events', []):
+        key = (event['cat'], event['name'])
+        count, duration = totals.get(key, (0, 0.))
+        totals[key] = (count + 1, duration + event['duration'])
+    return sorted(((cat, name, count, duration)
+                   for (cat, name), (count, duration) in totals.items()),
+                  key=lambda item: -item[3])
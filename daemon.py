@@ -0,0 +1,315 @@
+'''
+Build daemon
+============
+
+Keep a Buildozer process running for a project, so that the iterative
+builds do not pay for importing the targets, parsing and validating the
+spec, and loading the build state again.
+
+Start the daemon in the project directory::
+
+    buildozer daemon
+
+and run the commands through the thin client, which only needs the
+standard library (it falls back to running buildozer itself when no
+daemon is running)::
+
+    python -m buildozer.daemon android debug
+
+The client sends the command, its working directory and environment on a
+Unix socket, in a directory only the current user can access
+(``$XDG_RUNTIME_DIR``, or a private directory in the temporary directory);
+the daemon runs it and streams the output back. Both sides check that the
+other one runs as the same user. Commands needing user input are not
+supported, and the ``daemon`` command itself always runs in the client.
+'''
+
+import os
+import sys
+import stat
+import json
+import socket
+import struct
+import hashlib
+import tempfile
+from os.path import join, realpath, exists
+
+# ends the output of a command, followed by its exit code
+EXIT_MARKER = b'\0buildozer-exit:'
+
+# seconds a client has to send its request
+REQUEST_TIMEOUT = 10
+
+
+def _getuid():
+    return os.getuid() if hasattr(os, 'getuid') else 0
+
+
+def _check_private_dir(dn):
+    # the directory must be ours and closed to the other users, or anyone
+    # could replace the socket with their own
+    st = os.lstat(dn)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != _getuid() or
+            st.st_mode & 0o077):
+        raise PermissionError(
+            '{} is not a directory private to the current user'.format(dn))
+
+
+def socket_dir():
+    '''Directory of the daemon sockets of the current user, created if
+    needed.
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        try:
+            _check_private_dir(runtime_dir)
+            return runtime_dir
+        except OSError:
+            # missing, or not set up by the session manager as it should be
+            pass
+    dn = join(tempfile.gettempdir(), 'buildozer-{}'.format(_getuid()))
+    try:
+        os.mkdir(dn, 0o700)
+    except FileExistsError:
+        pass
+    _check_private_dir(dn)
+    return dn
+
+
+def socket_path(root_dir):
+    '''Path of the daemon socket of the project in `root_dir`.
+    '''
+    key = hashlib.sha1(realpath(root_dir).encode('utf-8')).hexdigest()[:12]
+    return join(socket_dir(), 'buildozer-{}.sock'.format(key))
+
+
+def _peer_uid(conn):
+    '''Return the user id of the process on the other side of `conn`, or
+    None if the platform cannot tell.
+    '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def _read_line(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class BuildozerDaemon:
+    '''
+    Serve the commands of the project in `root_dir`, one at a time.
+    '''
+
+    def __init__(self, root_dir, path=None):
+        self.root_dir = realpath(root_dir)
+        self.path = path or socket_path(self.root_dir)
+        self.running = False
+        # state stores reused between commands, with the stat of their file
+        # when the last command ended
+        self.state_stores = {}
+        self._store_stats = {}
+
+    def serve_forever(self):
+        if exists(self.path):
+            if ping(self.path):
+                raise RuntimeError('A daemon is already running on {}'.format(
+                    self.path))
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(4)
+        self.running = True
+        print('Buildozer daemon listening on {}'.format(self.path))
+        try:
+            while self.running:
+                conn, _ = server.accept()
+                with conn:
+                    if _peer_uid(conn) not in (None, _getuid()):
+                        continue
+                    try:
+                        self.handle(conn)
+                    except OSError:
+                        # the client went away, or did not send its request
+                        pass
+        finally:
+            server.close()
+            if exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, conn):
+        # a silent client must not block the other ones forever
+        conn.settimeout(REQUEST_TIMEOUT)
+        request = json.loads(_read_line(conn).decode('utf-8') or '{}')
+        conn.settimeout(None)
+        action = request.get('action', 'run')
+        code = 0
+        if action == 'stop':
+            self.running = False
+        elif action == 'run' and _is_daemon_command(request['args']):
+            # would wait on this very daemon
+            conn.sendall(b'The daemon command cannot run in the daemon\n')
+            code = 1
+        elif action == 'run':
+            code = self.run(request['args'], request['cwd'], request['env'],
+                            conn)
+        conn.sendall(EXIT_MARKER + str(code).encode('ascii') + b'\n')
+
+    def _drop_stale_stores(self):
+        # another buildozer process may have written the state meanwhile
+        for key, store in list(self.state_stores.items()):
+            if self._store_stats.get(key) != self._stat(store.filename):
+                del self.state_stores[key]
+
+    @staticmethod
+    def _stat(filename):
+        result = []
+        for fn in (filename, filename + '-wal'):
+            try:
+                st = os.stat(fn)
+                result.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                result.append(None)
+        return result
+
+    def run(self, args, cwd, env, conn):
+        '''Run a buildozer command line in `cwd` with `env`, its output
+        (including the one of the commands it runs) sent to `conn`. Return
+        the exit code.
+        '''
+        from buildozer import Buildozer, BuildozerException
+        import traceback
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        code = 0
+        try:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+            self._drop_stale_stores()
+            buildozer = Buildozer()
+            buildozer.state_stores = self.state_stores
+            buildozer.run_command(list(args))
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                code = e.code
+            elif e.code is not None:
+                print(e.code)
+                code = 1
+        except BuildozerException as e:
+            if e.args:
+                print(e.args[0])
+            code = 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved in enumerate(saved_fds):
+                os.dup2(saved, fd)
+                os.close(saved)
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            self._store_stats = {key: self._stat(store.filename)
+                                 for key, store in self.state_stores.items()}
+        return code
+
+
+def _is_daemon_command(args):
+    commands = [arg for arg in args if not arg.startswith('-')]
+    return commands[:1] == ['daemon']
+
+
+def _request(path, request, out=None):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    with conn:
+        # the request carries the environment, only give it to ourselves
+        uid = _peer_uid(conn)
+        if uid is None:
+            uid = os.stat(path).st_uid
+        if uid != _getuid():
+            raise PermissionError(
+                'The daemon socket {} belongs to another user'.format(path))
+        conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        out = out or getattr(sys.stdout, 'buffer', sys.stdout)
+        pending = b''
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                raise ConnectionError('The daemon closed the connection')
+            pending += chunk
+            index = pending.find(EXIT_MARKER)
+            if index != -1 and pending.endswith(b'\n'):
+                out.write(pending[:index])
+                out.flush()
+                return int(pending[index + len(EXIT_MARKER):])
+            # keep what could be the start of the marker for later
+            keep = len(EXIT_MARKER) if index == -1 else len(pending) - index
+            out.write(pending[:-keep])
+            out.flush()
+            pending = pending[-keep:]
+
+
+def ping(path):
+    '''Return True if a daemon answers on `path`.'''
+    try:
+        return _request(path, {'action': 'ping'}) == 0
+    except OSError:
+        return False
+
+
+def stop(path):
+    '''Stop the daemon listening on `path`, if any.'''
+    try:
+        _request(path, {'action': 'stop'})
+        return True
+    except OSError:
+        return False
+
+
+def main(args=None):
+    '''Run a buildozer command line through the daemon of the current
+    directory, or in this process if there is none.
+    '''
+    args = sys.argv[1:] if args is None else args
+    path = socket_path(os.getcwd())
+    if exists(path) and not _is_daemon_command(args):
+        try:
+            return _request(path, {'action': 'run', 'args': args,
+                                   'cwd': os.getcwd(),
+                                   'env': dict(os.environ)})
+        except (ConnectionRefusedError, FileNotFoundError):
+            # stale socket of a daemon that did not exit cleanly
+            pass
+
+    from buildozer import Buildozer
+    Buildozer().run_command(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,13 +3,407 @@ Academic Progress Tracker - Data Management System
 Handles all data persistence, logging, and backup operations
 """
 
+import gzip
 import json
 import os
+import re
 import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Callable, TYPE_CHECKING
 from pathlib import Path
 import logging
+from logging.handlers import RotatingFileHandler
+
+if TYPE_CHECKING:
+    from grade_engine import GradeEngine
+
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """Size-capped log handler that gzips rotated files"""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, max_age_days: int = 0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_age_days = max_age_days
+        self.namer = self._gzip_namer
+        self.rotator = self._gzip_rotator
+
+        # Roll over a log left behind by a previous day so each file stays date-scoped
+        if os.path.exists(self.baseFilename) and self._is_expired(self.baseFilename, days=1):
+            self.doRollover()
+
+    @staticmethod
+    def _gzip_namer(name: str) -> str:
+        return name + ".gz"
+
+    @staticmethod
+    def _gzip_rotator(source: str, dest: str):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    @staticmethod
+    def _is_expired(path: str, days: int) -> bool:
+        return time.time() - os.path.getmtime(path) > days * 86400
+
+    def doRollover(self):
+        super().doRollover()
+        self.remove_expired_logs()
+
+    def remove_expired_logs(self):
+        """Delete rotated logs, and legacy per-day logs, older than max_age_days"""
+        if not self.max_age_days:
+            return
+        log_dir, base_name = os.path.split(self.baseFilename)
+        # Per-day logs written before rotation existed, e.g. app_20240131.log
+        stem, ext = os.path.splitext(base_name)
+        legacy_pattern = re.compile(r'^{}_\d{{8}}{}$'.format(re.escape(stem), re.escape(ext)))
+        for filename in os.listdir(log_dir):
+            if filename == base_name:
+                continue
+            if not (filename.startswith(base_name) or legacy_pattern.match(filename)):
+                continue
+            file_path = os.path.join(log_dir, filename)
+            try:
+                if self._is_expired(file_path, self.max_age_days):
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+
+class GradeStore:
+    """Normalized SQLite store for subjects, components, weights and scores"""
+
+    # Key of the extra JSON recording how to rebuild the original document shape
+    SHAPE_KEY = '__shape__'
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    # ==================== CONNECTION ====================
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA foreign_keys = ON")
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._create_tables()
+        return self._conn
+
+    def _create_tables(self):
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS profile (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS subjects (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                extra TEXT
+            );
+            CREATE TABLE IF NOT EXISTS components (
+                subject_id TEXT NOT NULL REFERENCES subjects(id) ON DELETE CASCADE,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                extra TEXT,
+                PRIMARY KEY (subject_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS weights (
+                subject_id TEXT NOT NULL,
+                component TEXT NOT NULL,
+                weight REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (subject_id, component),
+                FOREIGN KEY (subject_id, component) REFERENCES components(subject_id, name)
+                    ON DELETE CASCADE ON UPDATE CASCADE
+            );
+            CREATE TABLE IF NOT EXISTS scores (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject_id TEXT NOT NULL,
+                component TEXT NOT NULL,
+                score REAL,
+                total REAL,
+                data TEXT,
+                FOREIGN KEY (subject_id, component) REFERENCES components(subject_id, name)
+                    ON DELETE CASCADE ON UPDATE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS scores_component ON scores (subject_id, component);
+        """)
+        self._conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        """Run a group of statements as a single commit"""
+        with self._lock:
+            conn = self.conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ==================== GRANULAR UPDATES ====================
+
+    def set_profile(self, values: Dict[str, Any]):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO profile (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in values.items()]
+            )
+
+    def upsert_subject(self, subject_id: str, name: str, position: Optional[int] = None,
+                       extra: Optional[Dict[str, Any]] = None):
+        with self.transaction() as conn:
+            if position is None:
+                position = conn.execute(
+                    "SELECT COALESCE((SELECT position FROM subjects WHERE id = ?), "
+                    "(SELECT COUNT(*) FROM subjects))", (subject_id,)
+                ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO subjects (id, name, position, extra) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, position = excluded.position, "
+                "extra = COALESCE(excluded.extra, subjects.extra)",
+                (subject_id, name, position, json.dumps(extra, ensure_ascii=False) if extra else None)
+            )
+
+    def delete_subject(self, subject_id: str) -> bool:
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM subjects WHERE id = ?", (subject_id,)).rowcount > 0
+
+    def upsert_component(self, subject_id: str, name: str, weight: Optional[float] = None,
+                         extra: Optional[Dict[str, Any]] = None):
+        with self.transaction() as conn:
+            position = conn.execute(
+                "SELECT COALESCE((SELECT position FROM components WHERE subject_id = ? AND name = ?), "
+                "(SELECT COUNT(*) FROM components WHERE subject_id = ?))", (subject_id, name, subject_id)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO components (subject_id, name, position, extra) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(subject_id, name) DO UPDATE SET extra = COALESCE(excluded.extra, components.extra)",
+                (subject_id, name, position, json.dumps(extra, ensure_ascii=False) if extra else None)
+            )
+            if weight is not None:
+                self._set_weight(conn, subject_id, name, weight)
+
+    def set_weight(self, subject_id: str, component: str, weight: float) -> bool:
+        with self.transaction() as conn:
+            return self._set_weight(conn, subject_id, component, weight)
+
+    @staticmethod
+    def _set_weight(conn: sqlite3.Connection, subject_id: str, component: str, weight: float) -> bool:
+        return conn.execute(
+            "INSERT INTO weights (subject_id, component, weight) VALUES (?, ?, ?) "
+            "ON CONFLICT(subject_id, component) DO UPDATE SET weight = excluded.weight",
+            (subject_id, component, float(weight))
+        ).rowcount > 0
+
+    def delete_component(self, subject_id: str, name: str) -> bool:
+        with self.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM components WHERE subject_id = ? AND name = ?", (subject_id, name)
+            ).rowcount > 0
+
+    def add_score(self, subject_id: str, component: str, score: float, total: float,
+                  data: Optional[Dict[str, Any]] = None) -> int:
+        with self.transaction() as conn:
+            # data is always set for dict grades, NULL marks a bare score
+            cursor = conn.execute(
+                "INSERT INTO scores (subject_id, component, score, total, data) VALUES (?, ?, ?, ?, ?)",
+                (subject_id, component, score, total, json.dumps(data or {}, ensure_ascii=False))
+            )
+            return cursor.lastrowid
+
+    def update_score(self, score_id: int, score: float, total: float) -> bool:
+        with self.transaction() as conn:
+            return conn.execute(
+                "UPDATE scores SET score = ?, total = ? WHERE id = ?", (score, total, score_id)
+            ).rowcount > 0
+
+    def delete_score(self, score_id: int) -> bool:
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM scores WHERE id = ?", (score_id,)).rowcount > 0
+
+    # ==================== QUERIES ====================
+
+    def get_subject_name(self, subject_id: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT name FROM subjects WHERE id = ?", (subject_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_score(self, score_id: int) -> Optional[Tuple[str, str, float, float]]:
+        """Return (subject_id, component, score, total) for a score row"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT subject_id, component, score, total FROM scores WHERE id = ?", (score_id,)
+            ).fetchone()
+
+    def list_scores(self, subject_id: str, component: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT id, component, score, total FROM scores WHERE subject_id = ?"
+        params = [subject_id]
+        if component is not None:
+            query += " AND component = ?"
+            params.append(component)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY id", params).fetchall()
+        return [{'id': row[0], 'component': row[1], 'score': row[2], 'total': row[3]} for row in rows]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            conn = self.conn
+            return (conn.execute("SELECT 1 FROM profile LIMIT 1").fetchone() is None and
+                    conn.execute("SELECT 1 FROM subjects LIMIT 1").fetchone() is None)
+
+    # ==================== WHOLE RECORD ====================
+
+    def replace_record(self, user_data: Dict[str, Any]):
+        """Replace the stored record with a full user data document"""
+        self._validate_record(user_data)
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM profile")
+            conn.execute("DELETE FROM subjects")
+            conn.executemany(
+                "INSERT INTO profile (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False))
+                 for key, value in user_data.items() if key != 'subjects']
+            )
+            subjects = user_data.get('subjects', [])
+            for subject_pos, (subject, subject_id) in enumerate(zip(subjects, self.subject_keys(subjects))):
+                extra = {k: v for k, v in subject.items() if k not in ('id', 'name', 'components')}
+                if 'id' not in subject:
+                    extra[self.SHAPE_KEY] = {'missing': ['id']}
+                elif not isinstance(subject['id'], str):
+                    # the key is str(id), keep the original value to restore
+                    extra[self.SHAPE_KEY] = {'id': subject['id']}
+                conn.execute(
+                    "INSERT INTO subjects (id, name, position, extra) VALUES (?, ?, ?, ?)",
+                    (subject_id, subject.get('name', ''), subject_pos,
+                     json.dumps(extra, ensure_ascii=False) if extra else None)
+                )
+                for component_pos, component in enumerate(subject.get('components', [])):
+                    name = component.get('name', '')
+                    extra = {k: v for k, v in component.items() if k not in ('name', 'weight', 'grades')}
+                    conn.execute(
+                        "INSERT INTO components (subject_id, name, position, extra) VALUES (?, ?, ?, ?)",
+                        (subject_id, name, component_pos, json.dumps(extra, ensure_ascii=False) if extra else None)
+                    )
+                    self._set_weight(conn, subject_id, name, component.get('weight', 0.0))
+                    conn.executemany(
+                        "INSERT INTO scores (subject_id, component, score, total, data) VALUES (?, ?, ?, ?, ?)",
+                        [self._score_row(subject_id, name, grade) for grade in component.get('grades', [])]
+                    )
+
+    @staticmethod
+    def subject_keys(subjects: List[Dict[str, Any]]) -> List[str]:
+        """Key of each subject in the tables: str(id), or for a subject without
+        id a generated key that no id of the document can collide with"""
+        taken = {str(subject['id']) for subject in subjects if 'id' in subject}
+        keys = []
+        for subject_pos, subject in enumerate(subjects):
+            if 'id' in subject:
+                keys.append(str(subject['id']))
+                continue
+            key = f'#{subject_pos}'
+            while key in taken:
+                key = '#' + key
+            taken.add(key)
+            keys.append(key)
+        return keys
+
+    @classmethod
+    def _validate_record(cls, user_data: Dict[str, Any]):
+        """Reject documents the normalized tables cannot represent"""
+        subject_ids = set()
+        subjects = user_data.get('subjects', [])
+        for subject, subject_id in zip(subjects, cls.subject_keys(subjects)):
+            if subject_id in subject_ids:
+                raise ValueError(f"Duplicate subject id {subject_id!r}")
+            subject_ids.add(subject_id)
+            names = set()
+            for component in subject.get('components', []):
+                name = component.get('name', '')
+                if name in names:
+                    raise ValueError(
+                        f"Duplicate component {name!r} in subject {subject.get('name', subject_id)!r}")
+                names.add(name)
+
+    @classmethod
+    def _score_row(cls, subject_id: str, component: str, grade: Any) -> Tuple:
+        if isinstance(grade, dict):
+            # data is always set for dict grades, NULL marks a bare score
+            extra = {k: v for k, v in grade.items() if k not in ('score', 'total')}
+            missing = [key for key in ('score', 'total') if key not in grade]
+            if missing:
+                extra[cls.SHAPE_KEY] = {'missing': missing}
+            return (subject_id, component, grade.get('score'), grade.get('total'),
+                    json.dumps(extra, ensure_ascii=False))
+        return subject_id, component, grade, None, None
+
+    def load_record(self) -> Dict[str, Any]:
+        """Rebuild the full user data document from the normalized tables"""
+        with self._lock:
+            conn = self.conn
+            record = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM profile")}
+            subjects = {}
+            for subject_id, name, extra in conn.execute(
+                    "SELECT id, name, extra FROM subjects ORDER BY position, rowid"):
+                subject = {'id': subject_id, 'name': name}
+                subject.update(json.loads(extra) if extra else {})
+                shape = subject.pop(self.SHAPE_KEY, {})
+                if 'id' in shape.get('missing', ()):
+                    del subject['id']
+                elif 'id' in shape:
+                    subject['id'] = shape['id']
+                subject['components'] = []
+                subjects[subject_id] = subject
+
+            components = {}
+            for subject_id, name, extra, weight in conn.execute(
+                    "SELECT c.subject_id, c.name, c.extra, w.weight FROM components c "
+                    "LEFT JOIN weights w ON w.subject_id = c.subject_id AND w.component = c.name "
+                    "ORDER BY c.subject_id, c.position"):
+                component = {'name': name, 'weight': weight if weight is not None else 0.0}
+                component.update(json.loads(extra) if extra else {})
+                component['grades'] = []
+                subjects[subject_id]['components'].append(component)
+                components[(subject_id, name)] = component
+
+            for subject_id, component, score, total, data in conn.execute(
+                    "SELECT subject_id, component, score, total, data FROM scores ORDER BY id"):
+                # NULL data is a bare score (older rows stored dict grades
+                # without extra keys with NULL data too, but with a total)
+                if data is None and total is None:
+                    grade = score
+                else:
+                    grade = json.loads(data) if data else {}
+                    missing = grade.pop(self.SHAPE_KEY, {}).get('missing', ())
+                    grade.update({key: value for key, value in (('score', score), ('total', total))
+                                  if key not in missing})
+                components[(subject_id, component)]['grades'].append(grade)
+
+        record['subjects'] = list(subjects.values())
+        return record
+
+    def backup_to(self, backup_path: str):
+        with self._lock:
+            target = sqlite3.connect(backup_path)
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
 
 
 class DataSaver:
@@ -18,10 +412,17 @@ class DataSaver:
     # Configuration
     DATA_DIR = "academic_data"
     USER_FILE = "user_data.json"
+    STORE_FILE = "academic.db"
     LOGS_DIR = "logs"
     BACKUPS_DIR = "backups"
+    LOG_FILE = "app.log"
+    LOG_MAX_BYTES = 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_RETENTION_DAYS = 30
 
     def __init__(self):
+        self._store = None
+        self._engine = None
         self.setup_directories()
         self.setup_logging()
 
@@ -37,8 +438,14 @@ class DataSaver:
             Path(directory).mkdir(parents=True, exist_ok=True)
 
     def setup_logging(self):
-        """Setup logging configuration"""
-        log_file = os.path.join(self.DATA_DIR, self.LOGS_DIR, f"app_{datetime.now().strftime('%Y%m%d')}.log")
+        """Setup logging configuration (safe to call more than once)"""
+        log_file = os.path.abspath(os.path.join(self.DATA_DIR, self.LOGS_DIR, self.LOG_FILE))
+        self.logger = logging.getLogger('AcademicTracker')
+
+        # Reuse the handlers of a previous setup for the same log file
+        for handler in self.logger.handlers:
+            if isinstance(handler, CompressedRotatingFileHandler) and handler.baseFilename == log_file:
+                return
 
         # Create formatter
         formatter = logging.Formatter(
@@ -46,10 +453,16 @@ class DataSaver:
             datefmt='%Y-%m-%d %H:%M:%S'
         )
 
-        # Setup file handler
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        # Setup rotating file handler
+        file_handler = CompressedRotatingFileHandler(
+            log_file,
+            max_bytes=self.LOG_MAX_BYTES,
+            backup_count=self.LOG_BACKUP_COUNT,
+            max_age_days=self.LOG_RETENTION_DAYS
+        )
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
+        file_handler.remove_expired_logs()
 
         # Setup console handler
         console_handler = logging.StreamHandler()
@@ -57,11 +470,12 @@ class DataSaver:
         console_handler.setFormatter(formatter)
 
         # Configure logger
-        self.logger = logging.getLogger('AcademicTracker')
         self.logger.setLevel(logging.INFO)
 
-        # Clear existing handlers
-        self.logger.handlers.clear()
+        # Replace handlers pointing at another location
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
 
         # Add handlers
         self.logger.addHandler(file_handler)
@@ -74,21 +488,44 @@ class DataSaver:
         self.logger.info("=" * 60)
 
     def get_user_file_path(self) -> str:
-        """Get full path to user data file"""
+        """Get full path to the legacy JSON user data file"""
         return os.path.join(self.DATA_DIR, self.USER_FILE)
 
+    def get_store_path(self) -> str:
+        """Get full path to the SQLite academic store"""
+        return os.path.join(self.DATA_DIR, self.STORE_FILE)
+
+    @property
+    def store(self) -> GradeStore:
+        """Academic store, opened on first use"""
+        if self._store is None:
+            self._store = GradeStore(self.get_store_path())
+        return self._store
+
+    @property
+    def grade_engine(self) -> 'GradeEngine':
+        """Weighted grade engine, loaded from the store on first use"""
+        if self._engine is None:
+            # Imported here so that numpy is only loaded when grades are computed
+            from grade_engine import GradeEngine
+            engine = GradeEngine()
+            record = self.store.load_record()
+            engine.load(record, GradeStore.subject_keys(record.get('subjects', [])))
+            self._engine = engine
+        return self._engine
+
     def save_user_data(self, user_data: Dict[str, Any]) -> bool:
-        """Save user data with logging and backup"""
+        """Save a full user data document with logging and backup"""
         try:
-            file_path = self.get_user_file_path()
+            file_path = self.get_store_path()
 
             # Create backup before saving
             if os.path.exists(file_path):
                 self.create_backup()
 
             # Save data
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(user_data, f, indent=2, ensure_ascii=False)
+            self.store.replace_record(user_data)
+            self._engine = None
 
             # Log success
             user_name = user_data.get('name', 'Unknown')
@@ -108,14 +545,11 @@ class DataSaver:
     def load_user_data(self) -> Optional[Dict[str, Any]]:
         """Load user data with logging"""
         try:
-            file_path = self.get_user_file_path()
-
-            if not os.path.exists(file_path):
+            if self.store.is_empty() and not self.migrate_legacy_data():
                 self.logger.info("📝 No existing user data found - new user")
                 return None
 
-            with open(file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
+            user_data = self.store.load_record()
 
             # Log success
             user_name = user_data.get('name', 'Unknown')
@@ -131,18 +565,152 @@ class DataSaver:
             self.logger.error(f"❌ Failed to load user data: {e}")
             return None
 
+    def migrate_legacy_data(self) -> bool:
+        """Import user_data.json into the academic store, if present"""
+        file_path = self.get_user_file_path()
+        if not os.path.exists(file_path):
+            return False
+
+        with open(file_path, 'r', encoding='utf-8') as f:
+            user_data = json.load(f)
+
+        self.store.replace_record(user_data)
+        self._engine = None
+        os.replace(file_path, file_path + ".migrated")
+        self.logger.info(f"📦 Migrated {self.USER_FILE} into {self.STORE_FILE}")
+        return True
+
+    # ==================== GRANULAR UPDATES ====================
+
+    def upsert_subject(self, subject_id: str, name: str) -> bool:
+        """Add or rename a single subject"""
+        try:
+            self.store.upsert_subject(subject_id, name)
+            self.log_subject_action("Saved", name)
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to save subject {name}: {e}")
+            return False
+
+    def delete_subject(self, subject_id: str) -> bool:
+        """Delete a subject together with its components and scores"""
+        try:
+            name = self.store.get_subject_name(subject_id) or subject_id
+            if not self.store.delete_subject(subject_id):
+                return False
+            if self._engine is not None:
+                self._engine.remove_subject(subject_id)
+            self.log_subject_action("Deleted", name)
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to delete subject {subject_id}: {e}")
+            return False
+
+    def upsert_component(self, subject_id: str, component: str, weight: Optional[float] = None) -> bool:
+        """Add a grading component to a subject, optionally setting its weight"""
+        try:
+            self.store.upsert_component(subject_id, component, weight)
+            if self._engine is not None and weight is not None:
+                self._engine.set_weight(subject_id, component, weight)
+            details = f"weight {weight:.0f}%" if weight is not None else ""
+            self.log_subject_action("Component Saved", self.store.get_subject_name(subject_id) or subject_id,
+                                    f"{component} {details}".strip())
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to save component {component}: {e}")
+            return False
+
+    def set_component_weight(self, subject_id: str, component: str, weight: float) -> bool:
+        """Update the weight of a single component"""
+        try:
+            if not self.store.set_weight(subject_id, component, weight):
+                return False
+            if self._engine is not None:
+                self._engine.set_weight(subject_id, component, weight)
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to set weight for {component}: {e}")
+            return False
+
+    def slider_callback(self, subject_id: str) -> Callable[[str, float], None]:
+        """Build an on_change callback for a ModernSlider of this subject"""
+        def on_change(component_name: str, value: float):
+            self.set_component_weight(subject_id, component_name, value)
+        return on_change
+
+    def delete_component(self, subject_id: str, component: str) -> bool:
+        """Delete a component together with its scores"""
+        try:
+            if not self.store.delete_component(subject_id, component):
+                return False
+            self._engine = None
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to delete component {component}: {e}")
+            return False
+
+    def add_grade(self, subject_id: str, component: str, score: float, total: float,
+                  **details: Any) -> Optional[int]:
+        """Record a score, returning its id"""
+        try:
+            score_id = self.store.add_score(subject_id, component, score, total, details or None)
+            if self._engine is not None and total:
+                self._engine.add_score(subject_id, component, score, total)
+            self.log_grade_action("Added", self.store.get_subject_name(subject_id) or subject_id,
+                                  component, score, total)
+            return score_id
+        except Exception as e:
+            self.logger.error(f"❌ Failed to add grade for {component}: {e}")
+            return None
+
+    def update_grade(self, score_id: int, score: float, total: float) -> bool:
+        """Change a recorded score in place"""
+        try:
+            row = self.store.get_score(score_id)
+            if row is None or not self.store.update_score(score_id, score, total):
+                return False
+            subject_id, component = row[0], row[1]
+            if self._engine is not None:
+                if row[3]:
+                    self._engine.remove_score(subject_id, component, row[2] or 0.0, row[3])
+                if total:
+                    self._engine.add_score(subject_id, component, score, total)
+            self.log_grade_action("Updated", self.store.get_subject_name(subject_id) or subject_id,
+                                  component, score, total)
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to update grade {score_id}: {e}")
+            return False
+
+    def delete_grade(self, score_id: int) -> bool:
+        """Delete a recorded score"""
+        try:
+            row = self.store.get_score(score_id)
+            if row is None or not self.store.delete_score(score_id):
+                return False
+            subject_id, component = row[0], row[1]
+            if self._engine is not None and row[3]:
+                self._engine.remove_score(subject_id, component, row[2] or 0.0, row[3])
+            self.log_grade_action("Deleted", self.store.get_subject_name(subject_id) or subject_id, component)
+            return True
+        except Exception as e:
+            self.logger.error(f"❌ Failed to delete grade {score_id}: {e}")
+            return False
+
+    # ==================== BACKUPS ====================
+
     def create_backup(self) -> bool:
         """Create a backup of current user data"""
         try:
-            source_file = self.get_user_file_path()
+            source_file = self.get_store_path()
             if not os.path.exists(source_file):
                 return False
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"user_data_backup_{timestamp}.json"
+            backup_filename = f"user_data_backup_{timestamp}.db"
             backup_path = os.path.join(self.DATA_DIR, self.BACKUPS_DIR, backup_filename)
 
-            shutil.copy2(source_file, backup_path)
+            self.store.backup_to(backup_path)
 
             self.logger.info(f"💾 Backup created: {backup_filename}")
 
@@ -162,7 +730,7 @@ class DataSaver:
             backup_files = []
 
             for filename in os.listdir(backup_dir):
-                if filename.startswith("user_data_backup_") and filename.endswith(".json"):
+                if filename.startswith("user_data_backup_") and filename.endswith((".json", ".db")):
                     file_path = os.path.join(backup_dir, filename)
                     backup_files.append((file_path, os.path.getctime(file_path)))
 
@@ -199,6 +767,10 @@ class DataSaver:
             message += f" ({score}/{total} = {(score / total) * 100:.1f}%)"
         self.logger.info(message)
 
+    def get_weighted_averages(self) -> Dict[str, Optional[float]]:
+        """Weighted average per subject id"""
+        return self.grade_engine.weighted_averages()
+
     def log_app_event(self, event: str, details: str = ""):
         """Log application events"""
         message = f"🎯 App Event: {event}"
@@ -211,7 +783,7 @@ class DataSaver:
         try:
             summary = {
                 'data_directory': self.DATA_DIR,
-                'user_file_exists': os.path.exists(self.get_user_file_path()),
+                'user_file_exists': os.path.exists(self.get_store_path()),
                 'user_file_size': 0,
                 'backup_count': 0,
                 'log_files': [],
@@ -219,7 +791,7 @@ class DataSaver:
             }
 
             # User file info
-            user_file = self.get_user_file_path()
+            user_file = self.get_store_path()
             if os.path.exists(user_file):
                 summary['user_file_size'] = os.path.getsize(user_file)
                 summary['last_modified'] = datetime.fromtimestamp(
@@ -229,13 +801,13 @@ class DataSaver:
             # Backup count
             backup_dir = os.path.join(self.DATA_DIR, self.BACKUPS_DIR)
             if os.path.exists(backup_dir):
-                backup_files = [f for f in os.listdir(backup_dir) if f.endswith('.json')]
+                backup_files = [f for f in os.listdir(backup_dir) if f.endswith(('.json', '.db'))]
                 summary['backup_count'] = len(backup_files)
 
             # Log files
             logs_dir = os.path.join(self.DATA_DIR, self.LOGS_DIR)
             if os.path.exists(logs_dir):
-                log_files = [f for f in os.listdir(logs_dir) if f.endswith('.log')]
+                log_files = [f for f in os.listdir(logs_dir) if f.endswith('.log') or f.endswith('.gz')]
                 summary['log_files'] = log_files
 
             return summary
@@ -291,44 +863,57 @@ class DataSaver:
         print("=" * 60)
 
 
-# Global data saver instance
-data_saver = DataSaver()
+# Global data saver instance, created lazily on first use
+_data_saver: Optional[DataSaver] = None
+_data_saver_lock = threading.Lock()
 
 
 def get_data_saver() -> DataSaver:
-    """Get the global data saver instance"""
-    return data_saver
+    """Get the global data saver instance, creating it on first use"""
+    global _data_saver
+    if _data_saver is None:
+        with _data_saver_lock:
+            if _data_saver is None:
+                _data_saver = DataSaver()
+    return _data_saver
+
+
+def __getattr__(name: str):
+    # Keep `from data_saver import data_saver` working without import-time setup
+    if name == "data_saver":
+        return get_data_saver()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Convenience functions for easy importing
 def save_user_data(user_data: Dict[str, Any]) -> bool:
     """Save user data"""
-    return data_saver.save_user_data(user_data)
+    return get_data_saver().save_user_data(user_data)
 
 
 def load_user_data() -> Optional[Dict[str, Any]]:
     """Load user data"""
-    return data_saver.load_user_data()
+    return get_data_saver().load_user_data()
 
 
 def log_action(action: str, details: str = ""):
     """Log a user action"""
-    data_saver.log_user_action(action, details)
+    get_data_saver().log_user_action(action, details)
 
 
 def log_subject(action: str, subject_name: str, details: str = ""):
     """Log a subject action"""
-    data_saver.log_subject_action(action, subject_name, details)
+    get_data_saver().log_subject_action(action, subject_name, details)
 
 
 def log_grade(action: str, subject_name: str, component: str, score: float = None, total: float = None):
     """Log a grade action"""
-    data_saver.log_grade_action(action, subject_name, component, score, total)
+    get_data_saver().log_grade_action(action, subject_name, component, score, total)
 
 
 def log_app(event: str, details: str = ""):
     """Log an app event"""
-    data_saver.log_app_event(event, details)
+    get_data_saver().log_app_event(event, details)
 
 
 if __name__ == "__main__":
@@ -362,6 +947,6 @@ if __name__ == "__main__":
     loaded_data = load_user_data()
 
     print("📊 Testing report...")
-    data_saver.print_data_report()
+    get_data_saver().print_data_report()
 
     print("✅ Data saver demo complete!")
\ No newline at end of file
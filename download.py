@@ -0,0 +1,261 @@
+'''
+Download manager
+================
+
+Download files into a content-addressed cache: every file is stored once,
+under its sha256, and an index maps the URLs to their content. A download
+interrupted midway is resumed with an HTTP range request from the same
+location, checksums are verified before a file enters the cache, and several
+files can be downloaded concurrently.
+
+Only the downloads with a checksum enter the cache: without one, nothing
+tells that the content of the URL did not change (think of a "latest"
+release), so it is downloaded again each time, and only its last download
+is kept, outside of the cache.
+
+Mirrors (``https://`` or ``file://`` base URLs, or plain directories) are
+tried before the original location, using the file name of the URL, which
+makes it possible to build offline from a local copy of the artifacts.
+'''
+
+import os
+import json
+import hashlib
+import threading
+from os.path import join, exists, basename
+from urllib.parse import urlsplit, unquote
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+from concurrent.futures import ThreadPoolExecutor
+
+USER_AGENT = (
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/28.0.1500.71 Safari/537.36')
+
+CHUNK_SIZE = 256 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def parse_checksum(checksum):
+    '''Split a checksum written as "algorithm:hexdigest" (sha256 when the
+    algorithm is omitted) into its two parts.
+    '''
+    if ':' in checksum:
+        algorithm, digest = checksum.split(':', 1)
+    else:
+        algorithm, digest = 'sha256', checksum
+    return algorithm.lower(), digest.lower()
+
+
+class DownloadManager:
+    '''
+    Download URLs into `cache_dir`. `progress`, if set, is called with
+    (url, downloaded, total) while a file is downloaded; total is -1 when
+    the server does not tell the size.
+    '''
+
+    def __init__(self, cache_dir, mirrors=(), workers=4, progress=None,
+                 timeout=60):
+        self.cache_dir = cache_dir
+        self.mirrors = list(mirrors)
+        self.workers = workers
+        self.progress = progress
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._index = None
+
+    @property
+    def index_path(self):
+        return join(self.cache_dir, 'index.json')
+
+    def blob_path(self, sha256):
+        return join(self.cache_dir, 'sha256', sha256[:2], sha256)
+
+    def _unverified_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return join(self.cache_dir, 'unverified', key)
+
+    def _partial_path(self, source):
+        # keyed by the location actually downloaded, so a resume never
+        # appends the bytes of a mirror to the ones of another
+        key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        return join(self.cache_dir, 'partial', key + '.part')
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, encoding='utf-8') as fd:
+                    self._index = json.load(fd)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _remember(self, url, sha256):
+        with self._lock:
+            index = self._load_index()
+            index[url] = sha256
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(self.index_path, threading.get_ident())
+            with open(tmp, 'w', encoding='utf-8') as fd:
+                json.dump(index, fd, indent=1, sort_keys=True)
+            os.replace(tmp, self.index_path)
+
+    def cached(self, url, checksum=None):
+        '''Return the cached file of `url`, or None if it has not been
+        downloaded yet, or does not match `checksum`. Without `checksum`,
+        the cached file cannot be trusted to be current, and None is
+        returned.
+        '''
+        if not checksum:
+            return None
+        algorithm, digest = parse_checksum(checksum)
+        if algorithm == 'sha256' and exists(self.blob_path(digest)):
+            # the content is what we want, wherever it came from
+            return self.blob_path(digest)
+        with self._lock:
+            sha256 = self._load_index().get(url)
+        if sha256 is None or not exists(self.blob_path(sha256)):
+            return None
+        if not self._matches(self.blob_path(sha256), checksum):
+            return None
+        return self.blob_path(sha256)
+
+    @staticmethod
+    def _matches(filename, checksum):
+        algorithm, digest = parse_checksum(checksum)
+        hasher = hashlib.new(algorithm)
+        with open(filename, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest() == digest
+
+    def sources(self, url):
+        '''The locations to try for `url`: the mirrors first, then the
+        original one.
+        '''
+        name = unquote(basename(urlsplit(url).path))
+        for mirror in self.mirrors:
+            if '://' not in mirror:
+                filename = join(mirror, name)
+                if exists(filename):
+                    yield filename
+                continue
+            yield '{}/{}'.format(mirror.rstrip('/'), name)
+        yield url
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def fetch(self, url, checksum=None):
+        '''Return the cached file of `url`, downloading it first if needed.
+        '''
+        # a single download per url, the others wait for it
+        with self._url_lock(url):
+            filename = self.cached(url, checksum)
+            if filename is not None:
+                return filename
+            return self._fetch(url, checksum)
+
+    def _fetch(self, url, checksum):
+        errors = []
+        for source in self.sources(url):
+            try:
+                partial, sha256 = self._download(source, url, checksum)
+            except (OSError, DownloadError) as e:
+                errors.append('{}: {}'.format(source, e))
+                continue
+            if checksum:
+                filename = self.blob_path(sha256)
+            else:
+                # never served from the cache, only keep the last download
+                filename = self._unverified_path(url)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            os.replace(partial, filename)
+            if checksum:
+                self._remember(url, sha256)
+            return filename
+        raise DownloadError('Unable to download {}:\n{}'.format(
+            url, '\n'.join(errors)))
+
+    def fetch_many(self, items):
+        '''Download every (url, checksum) of `items` concurrently, and
+        return their cached files in the same order.
+        '''
+        items = list(items)
+        if len(items) <= 1 or self.workers <= 1:
+            return [self.fetch(url, checksum) for url, checksum in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.fetch, url, checksum)
+                       for url, checksum in items]
+            return [future.result() for future in futures]
+
+    def _open(self, source, offset):
+        if '://' not in source:
+            fd = open(source, 'rb')
+            fd.seek(offset)
+            return fd, os.fstat(fd.fileno()).st_size, offset
+        request = Request(source, headers={'User-Agent': USER_AGENT})
+        if offset and urlsplit(source).scheme in ('http', 'https'):
+            request.add_header('Range', 'bytes={}-'.format(offset))
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            if e.code == 416 and offset:
+                # the partial file is no longer valid, start over
+                return self._open(source, 0)
+            raise
+        except URLError as e:
+            raise DownloadError(e.reason)
+        length = response.headers.get('Content-Length')
+        length = int(length) if length is not None else -1
+        if getattr(response, 'status', None) == 206:
+            total = offset + length if length >= 0 else -1
+            return response, total, offset
+        # the server (or the scheme) ignored the range, start over
+        return response, length, 0
+
+    def _download(self, source, url, checksum):
+        partial = self._partial_path(source)
+        os.makedirs(join(self.cache_dir, 'partial'), exist_ok=True)
+        offset = os.path.getsize(partial) if exists(partial) else 0
+        fd, total, offset = self._open(source, offset)
+
+        sha = hashlib.sha256()
+        expected = None
+        if checksum:
+            algorithm, digest = parse_checksum(checksum)
+            expected = (hashlib.new(algorithm), digest)
+        hashers = [sha] + ([expected[0]] if expected else [])
+
+        with fd, open(partial, 'r+b' if offset else 'wb') as out:
+            if offset:
+                # hash what was downloaded before the interruption
+                for chunk in iter(lambda: out.read(CHUNK_SIZE), b''):
+                    for hasher in hashers:
+                        hasher.update(chunk)
+            out.seek(offset)
+            out.truncate()
+            downloaded = offset
+            for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+                out.write(chunk)
+                for hasher in hashers:
+                    hasher.update(chunk)
+                downloaded += len(chunk)
+                if self.progress:
+                    self.progress(url, downloaded, total)
+
+        if total >= 0 and downloaded < total:
+            # keep the partial file, the next attempt will resume it
+            raise DownloadError('incomplete download ({} of {} bytes)'.format(
+                downloaded, total))
+        if expected and expected[0].hexdigest() != expected[1]:
+            os.unlink(partial)
+            raise DownloadError('checksum mismatch, expected {}'.format(
+                checksum))
+
+        return partial, sha.hexdigest()
@@ -0,0 +1,183 @@
+"""
+Academic Progress Tracker - Weighted Grade Engine
+Keeps component weights and scores in array form and recomputes
+weighted averages for every changed subject in one pass
+"""
+
+from typing import Dict, Any, Optional, List
+
+try:
+    import numpy as np
+except ImportError:
+    # pure Python fallback
+    np = None
+
+
+class SubjectGrades:
+    """Component weights and running score totals for one subject"""
+
+    __slots__ = ('components', 'index', 'weights', 'score_sums', 'total_sums', 'counts')
+
+    def __init__(self):
+        self.components: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.weights: List[float] = []
+        self.score_sums: List[float] = []
+        self.total_sums: List[float] = []
+        # Number of scores in each sum, to reset them exactly once emptied
+        self.counts: List[int] = []
+
+    def slot(self, component: str) -> int:
+        """Index of a component, adding it if needed"""
+        pos = self.index.get(component)
+        if pos is None:
+            pos = len(self.components)
+            self.index[component] = pos
+            self.components.append(component)
+            self.weights.append(0.0)
+            self.score_sums.append(0.0)
+            self.total_sums.append(0.0)
+            self.counts.append(0)
+        return pos
+
+
+class GradeEngine:
+    """Weighted average calculator with per-subject cache invalidation"""
+
+    def __init__(self, use_numpy: bool = True):
+        self.use_numpy = use_numpy and np is not None
+        self._subjects: Dict[str, SubjectGrades] = {}
+        self._averages: Dict[str, Optional[float]] = {}
+        self._dirty = set()
+
+    # ==================== LOADING ====================
+
+    def load(self, user_data: Dict[str, Any], subject_ids: Optional[List[str]] = None):
+        """Replace the engine contents with a full user data document, the
+        subjects keyed by subject_ids (default: their id, or position)"""
+        self._subjects.clear()
+        self._averages.clear()
+        self._dirty.clear()
+        for subject_pos, subject in enumerate(user_data.get('subjects', [])):
+            if subject_ids is not None:
+                subject_id = subject_ids[subject_pos]
+            else:
+                subject_id = str(subject.get('id', subject_pos))
+            grades = self._subjects[subject_id] = SubjectGrades()
+            for component in subject.get('components', []):
+                pos = grades.slot(component.get('name', ''))
+                grades.weights[pos] = float(component.get('weight', 0.0))
+                for grade in component.get('grades', []):
+                    if isinstance(grade, dict) and grade.get('total'):
+                        grades.score_sums[pos] += float(grade.get('score') or 0.0)
+                        grades.total_sums[pos] += float(grade['total'])
+                        grades.counts[pos] += 1
+            self._dirty.add(subject_id)
+
+    # ==================== UPDATES ====================
+
+    def set_weight(self, subject_id: str, component: str, weight: float):
+        grades = self._subject(subject_id)
+        pos = grades.slot(component)
+        if grades.weights[pos] != weight:
+            grades.weights[pos] = float(weight)
+            self._dirty.add(subject_id)
+
+    def add_score(self, subject_id: str, component: str, score: float, total: float):
+        grades = self._subject(subject_id)
+        pos = grades.slot(component)
+        grades.score_sums[pos] += float(score)
+        grades.total_sums[pos] += float(total)
+        grades.counts[pos] += 1
+        self._dirty.add(subject_id)
+
+    def remove_score(self, subject_id: str, component: str, score: float, total: float):
+        grades = self._subject(subject_id)
+        pos = grades.slot(component)
+        grades.counts[pos] -= 1
+        if grades.counts[pos] <= 0:
+            # Start from exact zeros rather than the rounding left by subtracting
+            grades.counts[pos] = 0
+            grades.score_sums[pos] = grades.total_sums[pos] = 0.0
+        else:
+            grades.score_sums[pos] -= float(score)
+            grades.total_sums[pos] -= float(total)
+        self._dirty.add(subject_id)
+
+    def remove_subject(self, subject_id: str):
+        self._subjects.pop(subject_id, None)
+        self._averages.pop(subject_id, None)
+        self._dirty.discard(subject_id)
+
+    def _subject(self, subject_id: str) -> SubjectGrades:
+        grades = self._subjects.get(subject_id)
+        if grades is None:
+            grades = self._subjects[subject_id] = SubjectGrades()
+        return grades
+
+    # ==================== RESULTS ====================
+
+    def component_percentages(self, subject_id: str) -> Dict[str, Optional[float]]:
+        grades = self._subjects.get(subject_id)
+        if grades is None:
+            return {}
+        return {
+            name: (score / total) * 100 if total else None
+            for name, score, total in zip(grades.components, grades.score_sums, grades.total_sums)
+        }
+
+    def weighted_average(self, subject_id: str) -> Optional[float]:
+        return self.weighted_averages().get(subject_id)
+
+    def weighted_averages(self) -> Dict[str, Optional[float]]:
+        """Weighted average per subject, recomputing only changed subjects"""
+        if self._dirty:
+            dirty = [subject_id for subject_id in self._dirty if subject_id in self._subjects]
+            if self.use_numpy:
+                self._averages.update(self._compute_numpy(dirty))
+            else:
+                self._averages.update(self._compute_python(dirty))
+            self._dirty.clear()
+        return dict(self._averages)
+
+    def _compute_python(self, subject_ids: List[str]) -> Dict[str, Optional[float]]:
+        result = {}
+        for subject_id in subject_ids:
+            grades = self._subjects[subject_id]
+            numerator = denominator = 0.0
+            for weight, score, total in zip(grades.weights, grades.score_sums, grades.total_sums):
+                if total:
+                    numerator += weight * (score / total) * 100
+                    denominator += weight
+            result[subject_id] = numerator / denominator if denominator else None
+        return result
+
+    def _compute_numpy(self, subject_ids: List[str]) -> Dict[str, Optional[float]]:
+        if not subject_ids:
+            return {}
+
+        # Flatten the components of every subject into one set of arrays
+        owners, weights, scores, totals = [], [], [], []
+        for pos, subject_id in enumerate(subject_ids):
+            grades = self._subjects[subject_id]
+            owners.extend([pos] * len(grades.components))
+            weights.extend(grades.weights)
+            scores.extend(grades.score_sums)
+            totals.extend(grades.total_sums)
+
+        owners = np.asarray(owners, dtype=np.intp)
+        weights = np.asarray(weights, dtype=float)
+        totals = np.asarray(totals, dtype=float)
+        graded = totals != 0
+        percentages = np.divide(np.asarray(scores, dtype=float) * 100, totals,
+                                out=np.zeros_like(totals), where=graded)
+        effective = np.where(graded, weights, 0.0)
+
+        count = len(subject_ids)
+        numerator = np.bincount(owners, weights=effective * percentages, minlength=count)
+        denominator = np.bincount(owners, weights=effective, minlength=count)
+
+        return {
+            subject_id: float(numerator[pos] / denominator[pos]) if denominator[pos] else None
+            for pos, subject_id in enumerate(subject_ids)
+        }
@@ -0,0 +1,168 @@
+"""
+Replacement for shelve, using json.
+This was needed to correctly support python 2 and 3.
+
+Every change is written to the disk right away, unless it is made inside a
+:meth:`JsonStore.batch` block: the store is then written once, when the
+outermost block exits. The file is replaced atomically, so an interrupted
+write never leaves a truncated state behind.
+
+:class:`SqliteStore` offers the same interface backed by SQLite, where only
+the modified keys are written.
+"""
+
+import io
+import os
+import sqlite3
+import threading
+from json import load, dump, loads, dumps
+from contextlib import contextmanager
+from os.path import exists, dirname, basename, join
+
+
+class JsonStore:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = {}
+        self._batch_level = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+        if exists(filename):
+            try:
+                with io.open(filename, encoding='utf-8') as fd:
+                    self.data = load(fd)
+            except ValueError:
+                print("Unable to read the state.db, content will be replaced.")
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self._changed()
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self._changed()
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def get(self, item, default=None):
+        return self.data.get(item, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def remove(self, key):
+        del self.data[key]
+        self._changed()
+
+    @contextmanager
+    def batch(self):
+        '''Defer the writes until the end of the block (blocks can be
+        nested). The changes made so far are written even if the block
+        raises.
+        '''
+        with self._lock:
+            self._batch_level += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_level -= 1
+                if not self._batch_level and self._dirty:
+                    self.sync()
+
+    def _changed(self):
+        with self._lock:
+            self._dirty = True
+            if not self._batch_level:
+                self.sync()
+
+    def sync(self):
+        with self._lock:
+            # write a temporary file next to the store, then rename it over
+            tmp = join(dirname(self.filename) or '.',
+                       '.{}.tmp'.format(basename(self.filename)))
+            with io.open(tmp, 'w', encoding='utf-8') as fd:
+                dump(self.data, fd, ensure_ascii=False)
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.replace(tmp, self.filename)
+            self._dirty = False
+
+
+class SqliteStore:
+    '''
+    Store with the interface of :class:`JsonStore`, backed by SQLite. The
+    values are JSON encoded. If `import_from` names an existing JsonStore
+    file and the database is new, its content is imported.
+    '''
+
+    def __init__(self, filename, import_from=None):
+        self.filename = filename
+        self._batch_level = 0
+        self._lock = threading.RLock()
+        is_new = not exists(filename)
+        self.db = sqlite3.connect(filename, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS store '
+                        '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        # the values are read much more often than written
+        self.data = {key: loads(value) for key, value in
+                     self.db.execute('SELECT key, value FROM store')}
+        if is_new and import_from and exists(import_from):
+            with self.batch():
+                for key, value in JsonStore(import_from).data.items():
+                    self[key] = value
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        with self.batch():
+            self.data[key] = value
+            self.db.execute('INSERT OR REPLACE INTO store VALUES (?, ?)',
+                            (key, dumps(value, ensure_ascii=False)))
+
+    def __delitem__(self, key):
+        with self.batch():
+            del self.data[key]
+            self.db.execute('DELETE FROM store WHERE key = ?', (key, ))
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def get(self, item, default=None):
+        return self.data.get(item, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def remove(self, key):
+        del self[key]
+
+    @contextmanager
+    def batch(self):
+        '''Group the changes of the block in one transaction (blocks can be
+        nested). The changes made so far are committed even if the block
+        raises.
+        '''
+        with self._lock:
+            if not self._batch_level:
+                self.db.execute('BEGIN')
+            self._batch_level += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_level -= 1
+                if not self._batch_level:
+                    self.db.execute('COMMIT')
+
+    def sync(self):
+        pass
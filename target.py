@@ -1,6 +1,14 @@
 from sys import exit
 import os
-from os.path import join
+import ast
+import hashlib
+from contextlib import contextmanager
+from os.path import join, dirname, getmtime
+try:
+    import fcntl
+except ImportError:
+    # on windows, no fcntl
+    fcntl = None
 
 
 def no_config(f):
@@ -47,6 +55,36 @@ class Target:
     def get_available_packages(self):
         return ['kivy']
 
+    def get_build_steps(self, steps):
+        '''Return the build steps to run, given the default ones (a list of
+        :class:`buildozer.BuildStep`). Targets can override this to declare
+        the inputs and outputs of their steps, so that the unchanged ones
+        are skipped, or to add steps.
+        '''
+        return steps
+
+    def get_platform_paths(self):
+        '''Return the paths of the files the compile_platform step creates
+        (the compiled distribution or toolchain output). The step is only
+        skipped when they all exist, so it always runs for a target that
+        does not know them.
+        '''
+        return ()
+
+    def get_artifact_paths(self):
+        '''Return the paths of the files the package step creates for the
+        current build_mode and artifact_format (usually in
+        `buildozer.bin_dir`). The package step is only skipped when they
+        all exist, so it always runs for a target that does not know them.
+        '''
+        return ()
+
+    def get_requirements_abi(self):
+        '''Tag of the platform the pure-Python application requirements are
+        installed for, used to key them in the global requirement cache.
+        '''
+        return self.buildozer.targetname
+
     def run_commands(self, args):
         if not args:
             self.buildozer.error('Missing target command')
@@ -151,6 +189,15 @@ class Target:
     def cmd_serve(self, *args):
         self.buildozer.cmd_serve()
 
+    def cmd_watch(self, *args):
+        options = args[0] if args else []
+        package = '--package' in options
+        if package:
+            self.buildozer.prepare_for_build()
+            self.build_mode = 'debug'
+            self.artifact_format = self.buildozer.config.getdefault('app', 'android.debug_artifact', 'apk')
+        self.buildozer.watch(package=package, poll='--poll' in options)
+
     def path_or_git_url(self, repo, owner='kivy', branch='master',
                         url_format='https://github.com/{owner}/{repo}.git',
                         platform=None,
@@ -245,19 +292,231 @@ class Target:
         :Returns:
             fully qualified path to updated git repo
         """
-        cmd = self.buildozer.cmd
+        install_dir, steps = self._install_or_update_repo_steps(
+            repo, **kwargs)
+        for command, cmd_kwargs in steps:
+            if callable(command):
+                command(**cmd_kwargs)
+            else:
+                self.buildozer.cmd(command, **cmd_kwargs)
+        return install_dir
+
+    def install_or_update_repos(self, repos):
+        """Install or update several git repositories concurrently.
+
+        :Parameters:
+            `repos`: list of (repo, kwargs) tuples, as accepted by
+                :meth:`install_or_update_repo`
+
+        :Returns:
+            list of the fully qualified paths to the updated git repos
+        """
+        install_dirs = []
+        jobs = []
+        for repo, kwargs in repos:
+            install_dir, steps = self._install_or_update_repo_steps(
+                repo, **kwargs)
+            install_dirs.append(install_dir)
+            if steps:
+                jobs.append((repo, steps))
+        self.buildozer.parallel_cmd(jobs)
+        return install_dirs
+
+    def _install_or_update_repo_steps(self, repo, **kwargs):
         install_dir = join(self.buildozer.platform_dir, repo)
         custom_dir, clone_url, clone_branch = self.path_or_git_url(repo, **kwargs)
+        steps = []
+        # like `cp -a`, and only the files modified since the last copy
+        copy_custom_dir = (self.buildozer.file_copytree,
+                           {'src': custom_dir, 'dest': install_dir,
+                            'preserve': True, 'symlinks': True, 'update': True})
         if not self.buildozer.file_exists(install_dir):
             if custom_dir:
-                cmd(["mkdir", "-p", install_dir])
-                cmd(["cp", "-a", f"{custom_dir}/*", f"{install_dir}/"])
+                steps.append(copy_custom_dir)
+            elif self.use_git_cache:
+                cache_dir = self.git_cache_dir(clone_url, repo)
+                steps.append(self._git_cache_step(clone_url, clone_branch, repo, [
+                    (["git", "worktree", "prune"], {'cwd': cache_dir}),
+                    (["git", "worktree", "add", "--force", "--detach",
+                      install_dir, self._git_cache_ref(clone_branch)],
+                     {'cwd': cache_dir}),
+                ]))
             else:
-                cmd(["git", "clone", "--branch", clone_branch, clone_url], cwd=self.buildozer.platform_dir)
+                steps.append((["git", "clone", "--branch", clone_branch, clone_url],
+                              {'cwd': self.buildozer.platform_dir}))
         elif self.platform_update:
             if custom_dir:
-                cmd(["cp", "-a", f"{custom_dir}/*", f"{install_dir}/"])
+                steps.append(copy_custom_dir)
+            elif self.use_git_cache and os.path.isfile(join(install_dir, '.git')):
+                # a worktree of the cache: fetch what changed, and move to it
+                steps.append(self._git_cache_step(clone_url, clone_branch, repo, [
+                    (["git", "checkout", "--force", "--detach",
+                      self._git_cache_ref(clone_branch)], {'cwd': install_dir}),
+                ]))
+                steps.append((["git", "clean", "-dxf"], {'cwd': install_dir}))
             else:
-                cmd(["git", "clean", "-dxf"], cwd=install_dir)
-                cmd(["git", "pull", "origin", clone_branch], cwd=install_dir)
-        return install_dir
+                steps.append((["git", "clean", "-dxf"], {'cwd': install_dir}))
+                steps.append((["git", "pull", "origin", clone_branch],
+                              {'cwd': install_dir}))
+        return install_dir, steps
+
+    @property
+    def use_git_cache(self):
+        '''Whether repositories are checked out from the shared cache
+        ([buildozer] git_cache, disabled by default). The checkouts are then
+        worktrees of the cache, on a detached HEAD.
+        '''
+        return self.buildozer.config.getbooldefault('buildozer', 'git_cache', False)
+
+    def git_cache_dir(self, url, repo):
+        '''Bare repository caching the objects of `url`, shared by every
+        project using it.
+        '''
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return join(self.buildozer.global_platform_dir, 'git',
+                    '{}-{}.git'.format(repo, key))
+
+    def _git_cache_ref(self, branch):
+        return 'refs/buildozer/{}'.format(branch)
+
+    @contextmanager
+    def _git_cache_lock(self, cache_dir):
+        # serializes the changes to a cache, between the jobs of this
+        # process (each opens its own lock file) and other buildozer processes
+        os.makedirs(dirname(cache_dir), exist_ok=True)
+        with open(cache_dir + '.lock', 'a') as fd:
+            if fcntl is not None:
+                fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _git_cache_step(self, url, branch, repo, commands):
+        '''Return a step fetching `branch` of `url` into the shared cache,
+        then running the (command, kwargs) of `commands`, with the cache
+        locked all along.
+        '''
+        return (self._run_git_cache_commands,
+                {'url': url, 'branch': branch, 'repo': repo,
+                 'commands': commands})
+
+    def _run_git_cache_commands(self, url, branch, repo, commands):
+        cmd = self.buildozer.cmd
+        cache_dir = self.git_cache_dir(url, repo)
+        with self._git_cache_lock(cache_dir):
+            if not os.path.isdir(cache_dir):
+                cmd(["git", "init", "--quiet", "--bare", cache_dir],
+                    output_prefix=repo)
+            # the worktrees share the config of the cache, this gives them
+            # an origin remote
+            cmd(["git", "config", "remote.origin.url", url],
+                cwd=cache_dir, output_prefix=repo)
+            cmd(["git", "config", "remote.origin.fetch",
+                 "+refs/heads/*:refs/remotes/origin/*"],
+                cwd=cache_dir, output_prefix=repo)
+            # only the tip of the branch (or tag) is fetched, and on update
+            # only the objects missing from the cache
+            cmd(["git", "fetch", "--depth", "1", url,
+                 "+{}:{}".format(branch, self._git_cache_ref(branch))],
+                cwd=cache_dir, output_prefix=repo)
+            for command, kwargs in commands:
+                cmd(command, output_prefix=repo, **kwargs)
+
+
+class TargetInfo:
+    '''
+    Description of a target module (its name, documentation and custom
+    commands), read from its source without importing it.
+    '''
+
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.doc = None
+        self.commands = []
+        # the module refuses to load on some platforms
+        self.guarded = False
+        self._module = None
+        self._parse()
+
+    def _parse(self):
+        with open(self.filename, 'rb') as fd:
+            tree = ast.parse(fd.read(), self.filename)
+        self.doc = ast.get_docstring(tree)
+        commands = {}
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                if not any(isinstance(base, ast.Name) and base.id == 'Target'
+                           for base in node.bases):
+                    continue
+                for item in node.body:
+                    if (isinstance(item, ast.FunctionDef) and
+                            item.name.startswith('cmd_')):
+                        commands[item.name[4:]] = ast.get_docstring(item)
+            elif self._raises_not_implemented(node):
+                self.guarded = True
+        if commands:
+            # inherited commands, as listed by Target.get_custom_commands()
+            for name in dir(Target):
+                if name.startswith('cmd_'):
+                    commands.setdefault(name[4:], getattr(Target, name).__doc__)
+        self.commands = sorted(commands.items())
+
+    @staticmethod
+    def _raises_not_implemented(node):
+        for child in ast.walk(node):
+            if not isinstance(child, ast.Raise) or child.exc is None:
+                continue
+            exc = child.exc
+            if isinstance(exc, ast.Call):
+                exc = exc.func
+            if isinstance(exc, ast.Name) and exc.id == 'NotImplementedError':
+                return True
+        return False
+
+    @property
+    def available(self):
+        '''False if the module raises NotImplementedError on this platform.
+        Only the modules that may do so are imported to find out.
+        '''
+        if not self.guarded:
+            return True
+        try:
+            self.load()
+        except NotImplementedError:
+            return False
+        return True
+
+    def load(self):
+        '''Import and return the target module.'''
+        if self._module is None:
+            self._module = __import__('buildozer.targets.{0}'.format(self.name),
+                                      fromlist=['buildozer'])
+        return self._module
+
+    def get_custom_commands(self, standard_cmds=()):
+        return [(name, doc) for name, doc in self.commands
+                if name not in standard_cmds]
+
+
+# parsed target modules, by filename and modification time
+_target_infos = {}
+
+
+def discover_targets(directory=None):
+    '''Return the :class:`TargetInfo` of every target module of `directory`
+    (buildozer/targets by default), sorted by name.
+    '''
+    if directory is None:
+        directory = join(dirname(__file__), 'targets')
+    infos = []
+    for fn in sorted(os.listdir(directory)):
+        if fn.startswith('.') or fn.startswith('__'):
+            continue
+        if not fn.endswith('.py'):
+            continue
+        filename = join(directory, fn)
+        key = (filename, getmtime(filename))
+        info = _target_infos.get(key)
+        if info is None:
+            info = _target_infos[key] = TargetInfo(fn[:-3], filename)
+        infos.append(info)
+    return infos
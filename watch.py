@@ -0,0 +1,223 @@
+'''
+Source watcher
+==============
+
+Wait for changes in the application sources, using inotify on Linux, and
+polling the files elsewhere (or when the inotify watches are exhausted).
+Only the files kept by a :class:`buildozer.SourceFilter` are considered, so
+editor swap files or changes in excluded directories do not trigger a
+rebuild.
+'''
+
+import os
+import sys
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+from time import monotonic, sleep
+from os.path import join
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _filtered_root(source_dir, root):
+    filtered_root = root[len(source_dir) + 1:].lower()
+    return filtered_root + '/' if filtered_root else filtered_root
+
+
+class PollingWatcher:
+    '''
+    Detect changes by comparing the size and modification time of the
+    source files every `interval` seconds.
+    '''
+
+    def __init__(self, source_dir, source_filter, interval=1.0):
+        self.source_dir = source_dir
+        self.source_filter = source_filter
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        result = {}
+        for root, files in self.source_filter.walk(self.source_dir):
+            for fn in files:
+                sfn = join(root, fn)
+                try:
+                    st = os.stat(sfn)
+                except OSError:
+                    continue
+                result[sfn] = (st.st_size, st.st_mtime_ns)
+        return result
+
+    def wait(self, timeout=None):
+        '''Return True as soon as a change is detected, or False after
+        `timeout` seconds without change.
+        '''
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            snapshot = self._snapshot()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return True
+            if deadline is not None and monotonic() >= deadline:
+                return False
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - monotonic()))
+            sleep(delay)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    '''
+    Detect changes with inotify, watching every directory of the source
+    tree that the filter does not exclude.
+    '''
+
+    def __init__(self, source_dir, source_filter):
+        self.source_dir = source_dir
+        self.source_filter = source_filter
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        try:
+            self._add_tree(source_dir)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, dn):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dn), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # removed meanwhile
+                return
+            # ENOSPC: out of watches (fs.inotify.max_user_watches)
+            raise OSError(error, 'inotify_add_watch failed on {}'.format(dn))
+        self.watches[wd] = dn
+
+    def _add_tree(self, top):
+        # the files are filtered later, watch each directory walked. Return
+        # True if the tree has source files.
+        found = False
+        for root, files in self.source_filter.walk(self.source_dir, top):
+            self._add_watch(root)
+            found = found or bool(files)
+        return found
+
+    def _is_relevant(self, dn, name, mask):
+        if mask & IN_Q_OVERFLOW or dn is None:
+            return True
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return True
+        filtered_root = _filtered_root(self.source_dir, dn)
+        if mask & IN_ISDIR:
+            if name.startswith('.'):
+                return False
+            return not self.source_filter.can_skip_tree(
+                filtered_root + name.lower() + '/')
+        if filtered_root and self.source_filter.is_dir_excluded(filtered_root):
+            return False
+        return self.source_filter.is_file_included(filtered_root, name)
+
+    def _read_events(self):
+        changed = False
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            dn = self.watches.get(wd)
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, watch the whole tree again
+                self._add_tree(self.source_dir)
+            elif (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and
+                    dn is not None):
+                # a new directory is only a change if it brings source files
+                # (created before its watch was added)
+                if self._add_tree(join(dn, name)):
+                    changed = True
+                continue
+            if self._is_relevant(dn, name, mask):
+                changed = True
+        return changed
+
+    def wait(self, timeout=None):
+        '''Return True as soon as a change is detected, or False after
+        `timeout` seconds without change.
+        '''
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready and self._read_events():
+                return True
+            if deadline is not None and monotonic() >= deadline:
+                return False
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(source_dir, source_filter, poll=False, interval=1.0):
+    '''Return an InotifyWatcher when possible, a PollingWatcher otherwise.
+    '''
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(source_dir, source_filter)
+        except (OSError, AttributeError, TypeError):
+            # no inotify, or not enough watches for this tree
+            pass
+    return PollingWatcher(source_dir, source_filter, interval)
+
+
+def watch(watcher, callback, debounce=0.3):
+    '''Call `callback` after each burst of changes, once no change happened
+    for `debounce` seconds. Run until interrupted.
+    '''
+    try:
+        while True:
+            watcher.wait()
+            while watcher.wait(debounce):
+                pass
+            callback()
+    finally:
+        watcher.close()